@@ -2,13 +2,23 @@
 import os
 import asyncio
 import websockets
-import json
-from typing import Optional
+from typing import Optional, Union
 
-from models import ConnectionManager
+from models import ConnectionManager, Frame
 from database import DatabaseManager
 from handlers import MessageHandler
 from background import BackgroundTasks
+from broadcast import Broadcaster
+from change_feed import ProductChangeFeed
+from presence import PresencePublisher
+from bus import EventBus
+from metrics import MetricsServer
+from logs import get_logger, setup_logging, dropped_count, SAMPLED
+import metrics
+import wire
+
+
+log = get_logger(__name__)
 
 
 class WebSocketServer:
@@ -20,77 +30,122 @@ class WebSocketServer:
         self.ping_interval = int(os.getenv('PING_INTERVAL', '10'))
         self.ping_timeout = int(os.getenv('PING_TIMEOUT', '5'))
         self.poll_interval = int(os.getenv('POLL_INTERVAL', '5'))
+        self.feed_health_interval = int(os.getenv('FEED_HEALTH_INTERVAL', '30'))
         self.stats_interval = 2
+        # Mensajes con `id` procesados en paralelo por conexión (1 = desactivado)
+        self.max_in_flight = max(1, int(os.getenv('MAX_IN_FLIGHT', '8')))
+        
+        # Modo multi-proceso (run.py --workers N): bus local entre workers
+        self.worker_id = int(os.getenv('WORKER_ID', '0'))
+        bus_socket = os.getenv('BUS_SOCKET')
+        self.bus = EventBus(bus_socket, self.worker_id) if bus_socket else None
+        # Solo el líder escucha la BD; el resto recibe los cambios por el bus
+        self.is_leader = self.worker_id == 0
         
         self.connections = ConnectionManager()
         self.database = DatabaseManager()
-        self.message_handler = MessageHandler(self.connections, self.database)
-        self.background = BackgroundTasks(self.connections, self.database)
+        self.broadcaster = Broadcaster(self.connections)
+        self.presence = PresencePublisher(self.connections, self.broadcaster, bus=self.bus)
+        self.message_handler = MessageHandler(
+            self.connections, self.database, self.broadcaster, self.presence, self.bus
+        )
+        self.change_feed = ProductChangeFeed()
+        # Con varios workers cada uno expone sus métricas en METRICS_PORT + WORKER_ID
+        self.metrics = MetricsServer(port=int(os.getenv('METRICS_PORT', '9101')) + self.worker_id)
+        metrics.CONNECTIONS.set_function(lambda: len(self.connections.clients))
+        self.background = BackgroundTasks(
+            self.connections, self.database, self.broadcaster, self.change_feed, self.presence, self.bus
+        )
+        
+        if self.bus is not None:
+            self.bus.subscribe('products', self.background.on_bus_products)
+            self.bus.subscribe('notify', self.message_handler.on_bus_notify)
+            self.bus.subscribe('idempotency', self.message_handler.on_bus_idempotency)
+            self.bus.subscribe('presence', self.presence.on_bus_presence)
     
     async def client_handler(self, ws) -> None:
         """Maneja un cliente conectado"""
+        tasks = set()
         try:
             # Agregar cliente
             self.connections.add_client(ws)
+            self.broadcaster.attach(ws)
+            state = self.connections.get_state(ws)
+            # Codec elegido en el handshake (subprotocolo websoker.<codec>)
+            self.broadcaster.set_codec(ws, wire.codec_for_subprotocol(ws.subprotocol))
             ip = ws.remote_address[0] if ws.remote_address else 'unknown'
-            print(f"✅ Cliente conectado: {ip} (puerto: {ws.remote_address[1] if ws.remote_address else 'unknown'})")
+            log.info("✅ Cliente conectado: %s (puerto: %s)", ip, ws.remote_address[1] if ws.remote_address else 'unknown', extra=SAMPLED)
             
-            # Notificar cambio de estado
-            try:
-                await self._broadcast_stats()
-            except Exception:
-                pass
+            # El nuevo cliente recibe el conteo al instante; el resto, agrupado
+            await self._send_safe(ws, self.presence.current_message())
+            self.presence.mark_dirty()
             
-            # Procesar mensajes
+            # Procesar mensajes (los que traen `id` pueden ir en paralelo, acotados)
+            in_flight = asyncio.Semaphore(self.max_in_flight)
             async for message in ws:
-                try:
-                    response = await self.message_handler.process_message(ws, message)
-                    
-                    if response:
-                        await self._send_safe(ws, response)
-                        
-                        # Si es un add_product exitoso, notificar a otros
-                        if response.get('type') == 'add_product' and response.get('status') == 'success':
-                            await self._broadcast_new_product(response.get('data', []))
-                except Exception as e:
-                    print(f"⚠️ Error procesando mensaje: {e}")
-                    try:
-                        await self._send_safe(ws, {'error': str(e)})
-                    except Exception:
-                        pass
+                self.connections.touch(ws)
+                data, error = self.message_handler.decode(message, state.codec)
+                if error:
+                    metrics.MESSAGES.inc('invalid')
+                    await self._send_safe(ws, error)
+                    continue
+                
+                if self.max_in_flight > 1 and self.message_handler.can_pipeline(data):
+                    # Sin cupo se deja de leer el socket: backpressure hacia el cliente
+                    await in_flight.acquire()
+                    task = asyncio.ensure_future(self._respond(ws, data))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                    task.add_done_callback(lambda _: in_flight.release())
+                else:
+                    await self._respond(ws, data)
         
         except websockets.exceptions.ConnectionClosed:
             ip = ws.remote_address[0] if ws.remote_address else 'unknown'
-            print(f"👋 Cliente desconectado normalmente: {ip}")
+            log.info("👋 Cliente desconectado normalmente: %s", ip, extra=SAMPLED)
         except Exception as e:
-            print(f"❌ Error en client_handler: {e}")
+            log.error("❌ Error en client_handler: %s", e)
         
         finally:
+            # Los mensajes en paralelo terminan aunque el cliente se haya ido
+            # (un add_product ya aceptado debe guardarse y difundirse)
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+            
             # Limpiar cliente
             self.connections.remove_client(ws)
             ip = ws.remote_address[0] if ws.remote_address else 'unknown'
-            print(f"🧹 Cliente limpiado: {ip}")
+            log.info("🧹 Cliente limpiado: %s", ip, extra=SAMPLED)
             
             # Notificar cambio de estado
-            try:
-                await self._broadcast_stats()
-            except Exception:
-                pass
+            self.presence.mark_dirty()
     
     async def start(self) -> None:
         """Inicia el servidor"""
+        setup_logging()
+        metrics.LOG_DROPPED.set_function(dropped_count)
+        
         # Conectar a BD
-        if not self.database.connect():
-            print("❌ No se puede conectar a la base de datos")
+        if not await self.database.connect():
+            log.error("❌ No se puede conectar a la base de datos")
             return
         
-        print(f"\n{'='*60}")
-        print(f"🚀 WebSocket Server iniciado")
-        print(f"   URL: ws://{self.host}:{self.port}")
-        print(f"   Heartbeat: {self.ping_interval}s")
-        print(f"   Product Poll: {self.poll_interval}s")
-        print(f"   Stats Broadcast: {self.stats_interval}s")
-        print(f"{'='*60}\n")
+        banner = [
+            '🚀 WebSocket Server iniciado',
+            f'   URL: ws://{self.host}:{self.port}',
+            f'   Heartbeat: {self.ping_interval}s',
+            f"   Product Feed: {'LISTEN/NOTIFY' if self.change_feed.enabled else 'polling'} (fallback poll {self.poll_interval}s)",
+            f'   Presence: cambios agrupados cada {self.presence.window}s (tick {self.stats_interval}s)',
+        ]
+        if self.bus is not None:
+            banner.append(f"   Worker: {self.worker_id}{' (líder)' if self.is_leader else ''} - bus {self.bus.path}")
+        if self.metrics.enabled:
+            banner.append(f'   Métricas: http://{self.metrics.host}:{self.metrics.port}/metrics')
+        log.info('\n'.join(banner))
+        
+        if self.bus is not None:
+            await self.bus.start()
+        await self.metrics.start()
         
         # Iniciar tareas en background como tareas separadas
         asyncio.create_task(self.background.heartbeat_loop(
@@ -100,64 +155,55 @@ class WebSocketServer:
         asyncio.create_task(self.background.stats_broadcast_loop(
             interval=self.stats_interval
         ))
-        asyncio.create_task(self.background.product_poller_loop(
-            interval=self.poll_interval
-        ))
+        if self.is_leader:
+            asyncio.create_task(self.background.product_feed_loop(
+                interval=self.poll_interval,
+                health_interval=self.feed_health_interval
+            ))
         
-        # Iniciar servidor WebSocket
-        async with websockets.serve(self.client_handler, self.host, self.port):
+        # Iniciar servidor WebSocket (con bus, los workers comparten el puerto)
+        async with websockets.serve(self.client_handler, self.host, self.port,
+                                    reuse_port=self.bus is not None, **wire.serve_options()):
             # Mantener el servidor vivo indefinidamente
-            await asyncio.sleep(float('inf'))
-    
-    async def _send_safe(self, ws, message: dict) -> bool:
-        """Envía mensaje de forma segura"""
-        try:
-            await ws.send(json.dumps(message))
-            return True
-        except Exception as e:
-            print(f"⚠️ Error enviando mensaje a {ws.remote_address}: {e}")
-            return False
+            try:
+                await asyncio.sleep(float('inf'))
+            finally:
+                # Apagado: escribir los add_product pendientes antes de cerrar el pool
+                await self.metrics.close()
+                await self.database.close()
     
-    async def _broadcast_stats(self) -> None:
-        """Envía estadísticas a todos"""
+    async def _respond(self, ws, data: dict) -> None:
+        """Procesa un mensaje y envía su respuesta"""
         try:
-            client_count = self.connections.get_clients_count()
-            clients = self.connections.get_clients()
+            response = await self.message_handler.dispatch(ws, data)
             
-            message = {
-                'type': 'clients_count',
-                'data': {
-                    'count': client_count,
-                    'clientsOnline': client_count,
-                    'timestamp': str(asyncio.get_event_loop().time())
-                }
-            }
-            
-            if clients:
-                for client in clients:
-                    try:
-                        await self._send_safe(client, message)
-                    except Exception:
-                        pass
+            if response:
+                await self._send_safe(ws, response)
+                
+                # Si es un add_product(s) exitoso, notificar a otros en un solo broadcast
+                if isinstance(response, dict) and response.get('type') in ('add_product', 'add_products') \
+                        and response.get('status') == 'success' and not response.get('replayed'):
+                    await self._broadcast_new_product(response.get('data', []))
         except Exception as e:
-            print(f"⚠️ Error broadcast stats: {e}")
+            log.warning("⚠️ Error procesando mensaje: %s", e)
+            try:
+                error = {'error': str(e)}
+                if data.get('id') is not None:
+                    error['id'] = data['id']
+                await self._send_safe(ws, error)
+            except Exception:
+                pass
+    
+    async def _send_safe(self, ws, message: Union[Frame, dict]) -> bool:
+        """Envía mensaje de forma segura (respuestas: esperan espacio en la cola)"""
+        return await self.broadcaster.send(ws, message, wait=True)
     
     async def _broadcast_new_product(self, products: list) -> None:
-        """Notifica a todos sobre nuevo producto"""
+        """Notifica sobre nuevo producto a los clientes cuyos filtros lo aceptan"""
         try:
-            clients = self.connections.get_clients()
-            
-            if clients:
-                for client in clients:
-                    try:
-                        await self._send_safe(client, {
-                            'type': 'new_product',
-                            'data': products
-                        })
-                    except Exception:
-                        pass
+            await self.background.broadcast_products('new_product', products)
         except Exception as e:
-            print(f"⚠️ Error broadcast product: {e}")
+            log.warning("⚠️ Error broadcast product: %s", e)
 
 
 async def main():
@@ -170,4 +216,4 @@ if __name__ == '__main__':
     try:
         asyncio.run(main())
     except Exception as e:
-        print(f"Error: {e}")
+        log.error("Error: %s", e)
@@ -1,102 +1,193 @@
 """Bucles de tareas en segundo plano"""
 import asyncio
-import json
 from typing import List
 
+from models import Frame
+from change_feed import ChangeFeedLost
+import metrics
+from logs import get_logger
+
+
+log = get_logger(__name__)
+
 
 class BackgroundTasks:
     """Gestor de tareas en segundo plano"""
     
-    def __init__(self, connections, database):
+    def __init__(self, connections, database, broadcaster, change_feed=None, presence=None, bus=None):
         self.connections = connections
         self.db = database
+        self.broadcaster = broadcaster
+        self.change_feed = change_feed
+        self.presence = presence
+        # Con varios workers, solo el líder lee la BD y reparte los cambios por el bus
+        self.bus = bus
     
     async def heartbeat_loop(self, interval: int = 10, timeout: int = 5) -> None:
         """Monitorea conexiones con heartbeat"""
-        print(f"Iniciando heartbeat (interval={interval}s, timeout={timeout}s)")
+        log.info("Iniciando heartbeat (interval=%ss, timeout=%ss)", interval, timeout)
         while True:
             try:
                 await asyncio.sleep(interval)
-                clients = self.connections.get_clients()
-                disconnected = []
-                
-                for ws in clients:
-                    try:
-                        pong = await asyncio.wait_for(ws.ping(), timeout=timeout)
-                        await pong
-                    except asyncio.TimeoutError:
-                        print(f"Heartbeat timeout para {ws.remote_address}")
-                        disconnected.append(ws)
-                    except Exception as e:
-                        print(f"Heartbeat error: {e}")
-                        disconnected.append(ws)
-                
-                # Limpiar clientes desconectados
-                for ws in disconnected:
-                    try:
-                        await ws.close()
-                    except Exception:
-                        pass
-                    self.connections.remove_client(ws)
+                await self._heartbeat_sweep(idle_for=interval, timeout=timeout)
             except Exception as e:
-                print(f"Error en heartbeat_loop: {e}")
+                log.error("Error en heartbeat_loop: %s", e)
                 await asyncio.sleep(interval)
     
+    async def _heartbeat_sweep(self, idle_for: float, timeout: float) -> None:
+        """
+        Hace ping en paralelo a los clientes sin tráfico reciente, con un único
+        deadline para todo el barrido. Quien no responde a tiempo se descarta.
+        """
+        clients = self.connections.get_idle_clients(idle_for)
+        if not clients:
+            return
+        
+        tasks = {asyncio.ensure_future(self._ping(ws)): ws for ws in clients}
+        done, pending = await asyncio.wait(tasks, timeout=timeout)
+        
+        for task in pending:
+            task.cancel()
+            ws = tasks[task]
+            log.warning("Heartbeat timeout para %s", ws.remote_address)
+            self.broadcaster.drop(ws)
+        
+        for task in done:
+            ws = tasks[task]
+            if task.exception() is not None:
+                log.warning("Heartbeat error: %s", task.exception())
+                self.broadcaster.drop(ws)
+            else:
+                self.connections.record_rtt(ws, task.result())
+                metrics.CLIENT_RTT_SECONDS.observe(task.result())
+    
+    @staticmethod
+    async def _ping(ws) -> float:
+        """Envía un ping y retorna el RTT en segundos"""
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        pong = await ws.ping()
+        await pong
+        return loop.time() - started
+    
     async def stats_broadcast_loop(self, interval: int = 2) -> None:
-        """Envía estadísticas periódicamente"""
-        print(f"Iniciando broadcast de stats (interval={interval}s)")
+        """Revisa la presencia periódicamente; solo se difunde si el conteo cambió"""
+        log.info("Iniciando broadcast de stats (interval=%ss)", interval)
         while True:
             try:
                 await asyncio.sleep(interval)
-                client_count = self.connections.get_clients_count()
-                connection_info = self.connections.get_connection_info()
-                
-                message = {
-                    'type': 'clients_count',
-                    'data': {
-                        'count': client_count,
-                        'clientsOnline': client_count,
-                        'timestamp': str(asyncio.get_event_loop().time())
-                    }
-                }
-                
-                await self._broadcast_all(message)
-                print(f"📊 Pestañas abiertas: {client_count} (IPs únicas: {connection_info['unique_ips']})")
+                self.presence.announce()
+                self.presence.mark_dirty()
             except Exception as e:
-                print(f"Error en stats_broadcast_loop: {e}")
+                log.error("Error en stats_broadcast_loop: %s", e)
                 await asyncio.sleep(interval)
     
     async def product_poller_loop(self, interval: int = 5) -> None:
         """Detecta nuevos productos periódicamente"""
-        print(f"Iniciando product poller (interval={interval}s)")
+        log.info("Iniciando product poller (interval=%ss)", interval)
         while True:
             try:
                 await asyncio.sleep(interval)
-                new_products = self.db.get_new_products()
-                
-                if new_products:
-                    print(f"✨ {len(new_products)} producto(s) nuevo(s) detectado(s)")
-                    for product in new_products:
-                        await self._broadcast_all({
-                            'type': 'new_product',
-                            'data': [product]
-                        })
+                await self._publish_new_products()
             except Exception as e:
-                print(f"Error en product_poller_loop: {e}")
+                log.error("Error en product_poller_loop: %s", e)
                 await asyncio.sleep(interval)
     
-    async def _broadcast_all(self, message: dict) -> None:
-        """Envía mensaje a todos los clientes"""
-        clients = self.connections.get_clients()
-        disconnected = []
+    async def product_feed_loop(self, interval: int = 5, health_interval: int = 30) -> None:
+        """Difunde cambios de productos en cuanto PostgreSQL los notifica"""
+        if not self.change_feed or not self.change_feed.enabled:
+            await self.product_poller_loop(interval)
+            return
+        reason = None
+        if not self.change_feed.supported():
+            reason = 'el event loop no soporta add_reader'
+        elif await self.change_feed.trigger_ready() is False:
+            reason = 'falta el trigger (scripts/install_product_trigger.py)'
+        if reason:
+            log.warning("⚠️ Feed LISTEN/NOTIFY desactivado: %s; productos por polling", reason)
+            self.change_feed.enabled = False
+            await self.product_poller_loop(interval)
+            return
         
-        for client in clients:
+        log.info("Iniciando feed de productos LISTEN/NOTIFY (health=%ss)", health_interval)
+        while True:
             try:
-                await client.send(json.dumps(message))
+                if not await self.change_feed.start():
+                    # Sin LISTEN disponible: un ciclo de polling y reintentar
+                    await asyncio.sleep(interval)
+                    await self._publish_new_products()
+                    continue
+                
+                # Catch-up por watermark: lo insertado mientras no escuchábamos
+                await self._publish_new_products()
+                
+                while True:
+                    events = await self.change_feed.wait(timeout=health_interval)
+                    if events:
+                        await self._handle_product_events(events)
+                    else:
+                        # Respaldo sin notificaciones: lo insertado por otros servicios
+                        # no se pierde si el trigger falta o la conexión no entrega NOTIFY
+                        await self._publish_new_products()
+            except ChangeFeedLost:
+                log.warning("Feed de productos perdido, reconectando...")
+                await self.change_feed.stop()
+                # Pudieron perderse UPDATEs mientras no escuchábamos
+                self.db.invalidate_catalog()
             except Exception as e:
-                print(f"Error broadcast: {e}")
-                disconnected.append(client)
+                log.error("Error en product_feed_loop: %s", e)
+                await self.change_feed.stop()
+                await asyncio.sleep(interval)
+    
+    async def _handle_product_events(self, events: List[dict]) -> None:
+        """Procesa un lote de notificaciones INSERT/UPDATE"""
+        if any(event.get('op') == 'INSERT' for event in events):
+            # El watermark garantiza orden y que no se pierdan filas
+            await self._publish_new_products()
         
-        # Limpiar desconectados
-        for client in disconnected:
-            self.connections.remove_client(client)
+        updated_ids = {
+            event.get('id') for event in events
+            if event.get('op') == 'UPDATE' and event.get('id') is not None
+        }
+        if updated_ids:
+            updated = await self.db.get_products_by_ids(updated_ids)
+            if updated:
+                if self.bus is not None:
+                    self.bus.publish('products', {'op': 'UPDATE', 'rows': updated})
+                await self._broadcast_updated(updated)
+    
+    async def _publish_new_products(self) -> None:
+        """Difunde los productos con ID mayor al último visto"""
+        new_products = await self.db.get_new_products()
+        
+        if new_products:
+            log.info("✨ %s producto(s) nuevo(s) detectado(s)", len(new_products))
+            if self.bus is not None:
+                self.bus.publish('products', {'op': 'INSERT', 'rows': new_products})
+            await self._broadcast_new(self.db.take_unannounced(new_products))
+    
+    async def on_bus_products(self, event: dict) -> None:
+        """Cambios de producto detectados por el worker líder"""
+        rows = event.get('rows') or []
+        if not rows:
+            return
+        self.db.observe_products(rows)
+        if event.get('op') == 'UPDATE':
+            await self._broadcast_updated(rows)
+        else:
+            await self._broadcast_new(self.db.take_unannounced(rows))
+    
+    async def _broadcast_new(self, products: List[dict]) -> None:
+        for product in products:
+            await self.broadcast_products('new_product', [product])
+    
+    async def _broadcast_updated(self, products: List[dict]) -> None:
+        await self.broadcast_products('product_updated', products)
+    
+    async def broadcast_products(self, msg_type: str, products: List[dict]) -> None:
+        """Difunde productos solo a quien le interesan (filtros de subscribe_products)"""
+        for clients, subset in self.connections.group_product_recipients(products):
+            await self.broadcaster.broadcast(clients, Frame({
+                'type': msg_type,
+                'data': subset
+            }))
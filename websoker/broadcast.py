@@ -0,0 +1,162 @@
+"""Motor de difusión concurrente de mensajes"""
+import os
+import time
+import asyncio
+from typing import Iterable, Optional, Union
+
+import wire
+from models import Frame
+from outbound import OutboundQueue
+import metrics
+from logs import get_logger
+
+
+log = get_logger(__name__)
+
+
+class Broadcaster:
+    """Envía mensajes a muchos clientes en paralelo con límite y deadline"""
+    
+    def __init__(self, connections, max_concurrency: Optional[int] = None,
+                 send_timeout: Optional[float] = None):
+        self.connections = connections
+        self.max_concurrency = max_concurrency or int(os.getenv('BROADCAST_CONCURRENCY', '256'))
+        self.send_timeout = send_timeout or float(os.getenv('SEND_TIMEOUT', '5'))
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._closing: set = set()
+        self.queue_size = int(os.getenv('OUTBOUND_QUEUE_SIZE', '256'))
+        self.queue_policy = os.getenv('OUTBOUND_POLICY', 'drop_oldest')
+        self.batch_window = float(os.getenv('BATCH_WINDOW_MS', '5')) / 1000
+        self.batch_max_size = int(os.getenv('BATCH_MAX_SIZE', '50'))
+        self.batch_max_bytes = int(os.getenv('BATCH_MAX_BYTES', '65536'))
+    
+    def attach(self, ws) -> None:
+        """Crea la cola de salida (y su tarea escritora) de un cliente registrado"""
+        state = self.connections.get_state(ws)
+        if state is None or state.outbound is not None or self.queue_size <= 0:
+            return
+        state.outbound = OutboundQueue(
+            ws,
+            maxsize=self.queue_size,
+            policy=self.queue_policy,
+            send_timeout=self.send_timeout,
+            on_dead=self.drop,
+            on_sent=self.connections.record_sent
+        )
+    
+    def set_codec(self, ws, codec) -> bool:
+        """Codec con el que se codifica todo lo que se envíe al cliente desde ahora"""
+        state = self.connections.get_state(ws)
+        if state is None:
+            return False
+        state.codec = codec
+        if state.outbound is not None:
+            state.outbound.codec = codec
+        return True
+    
+    def set_batching(self, ws, enabled: bool) -> bool:
+        """Activa o desactiva el agrupado en frames `batch` para un cliente"""
+        state = self.connections.get_state(ws)
+        if state is None or state.outbound is None:
+            return False
+        if enabled:
+            state.outbound.set_batching(self.batch_window, self.batch_max_size, self.batch_max_bytes)
+        else:
+            state.outbound.set_batching(0.0, 1, 0)
+        return True
+    
+    async def send(self, ws, message: Union[Frame, dict], wait: bool = False, flush: bool = False) -> bool:
+        """
+        Envía un mensaje a un cliente; si falla o vence el deadline lo descarta.
+        Con cola de salida solo encola: wait=True espera espacio en vez de
+        aplicar la política de desborde (respuestas) y flush=True además espera
+        a que se escriba (streams). Sin cola el envío ya es directo.
+        """
+        frame = Frame.wrap(message)
+        state = self.connections.get_state(ws)
+        if state is not None and state.outbound is not None:
+            if flush:
+                return await state.outbound.put_flush(frame, self.send_timeout)
+            if wait:
+                return await state.outbound.put_wait(frame, self.send_timeout)
+            return state.outbound.put(frame)
+        
+        payload = frame.encode(state.codec if state is not None else wire.JSON)
+        try:
+            async with self._semaphore:
+                await asyncio.wait_for(ws.send(payload), timeout=self.send_timeout)
+            self.connections.record_sent(ws)
+            return True
+        except asyncio.TimeoutError:
+            metrics.SEND_FAILURES.inc('timeout')
+            log.warning("⏱️ Timeout enviando mensaje a %s", ws.remote_address)
+        except Exception as e:
+            metrics.SEND_FAILURES.inc('error')
+            log.warning("⚠️ Error enviando mensaje a %s: %s", ws.remote_address, e)
+        
+        self.drop(ws)
+        return False
+    
+    async def broadcast(self, clients: Iterable, message: Union[Frame, dict],
+                        exclude_client=None) -> int:
+        """
+        Envía un mensaje a todos los destinatarios de forma concurrente.
+        El mensaje se serializa una sola vez.
+        Retorna: número de envíos exitosos
+        """
+        recipients = [c for c in clients if c is not exclude_client]
+        if not recipients:
+            return 0
+        
+        start = time.perf_counter()
+        try:
+            sent = await self._fan_out(recipients, Frame.wrap(message))
+        finally:
+            metrics.BROADCAST_SECONDS.observe(time.perf_counter() - start)
+        metrics.BROADCAST_RECIPIENTS.inc(amount=sent)
+        return sent
+    
+    async def _fan_out(self, recipients: list, frame: Frame) -> int:
+        sent = 0
+        
+        # Clientes con cola: encolar es inmediato y no bloquea al emisor
+        direct = []
+        for ws in recipients:
+            state = self.connections.get_state(ws)
+            if state is not None and state.outbound is not None:
+                if state.outbound.put(frame):
+                    sent += 1
+            else:
+                direct.append(ws)
+        if not direct:
+            return sent
+        
+        pending = iter(direct)
+        
+        async def worker() -> None:
+            nonlocal sent
+            for ws in pending:
+                if await self.send(ws, frame):
+                    sent += 1
+        
+        workers = min(len(direct), self.max_concurrency)
+        await asyncio.gather(*(worker() for _ in range(workers)))
+        return sent
+    
+    def drop(self, ws) -> None:
+        """Único camino de limpieza para sockets muertos o lentos"""
+        self.connections.remove_client(ws)
+        if ws in self._closing:
+            return
+        
+        # Cerrar en segundo plano para no bloquear al emisor
+        self._closing.add(ws)
+        task = asyncio.ensure_future(self._close(ws))
+        task.add_done_callback(lambda _: self._closing.discard(ws))
+    
+    @staticmethod
+    async def _close(ws) -> None:
+        try:
+            await ws.close()
+        except Exception:
+            pass
@@ -0,0 +1,135 @@
+"""Bus de eventos local entre procesos worker (sustituto de Redis pub/sub)"""
+import os
+import json
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from logs import get_logger, setup_logging
+
+
+log = get_logger(__name__)
+
+
+# Las líneas pueden llevar listas de productos completas
+LINE_LIMIT = 16 * 1024 * 1024
+# Si el otro extremo no lee, no acumular más de esto en el buffer de escritura
+MAX_WRITE_BUFFER = 8 * 1024 * 1024
+
+
+class BusBroker:
+    """
+    Proceso broker: acepta workers por un socket Unix y reenvía cada línea
+    JSON recibida a todos los demás workers conectados.
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        self._writers: set = set()
+    
+    async def serve_forever(self) -> None:
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        server = await asyncio.start_unix_server(self._handle, path=self.path, limit=LINE_LIMIT)
+        log.info("Bus de eventos escuchando en %s", self.path)
+        async with server:
+            await server.serve_forever()
+    
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._writers.add(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                for other in list(self._writers):
+                    if other is writer:
+                        continue
+                    if other.transport.get_write_buffer_size() > MAX_WRITE_BUFFER:
+                        log.warning("Bus: worker lento, evento descartado")
+                        continue
+                    other.write(line)
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError) as e:
+            log.warning("Bus: worker desconectado (%s)", e)
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+
+def run_broker(path: str) -> None:
+    """Punto de entrada del proceso broker"""
+    setup_logging()
+    try:
+        asyncio.run(BusBroker(path).serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+class EventBus:
+    """Cliente del bus dentro de un worker: publica y despacha eventos por tópico"""
+    
+    def __init__(self, path: str, worker_id: int, reconnect_delay: float = 1.0):
+        self.path = path
+        self.worker_id = worker_id
+        self.reconnect_delay = reconnect_delay
+        self._handlers: Dict[str, List[Callable[[Any], Awaitable[None]]]] = {}
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._task: Optional[asyncio.Task] = None
+    
+    def subscribe(self, topic: str, handler: Callable[[Any], Awaitable[None]]) -> None:
+        """Registra un handler async para los eventos de un tópico"""
+        self._handlers.setdefault(topic, []).append(handler)
+    
+    async def start(self) -> None:
+        """Conecta al broker en segundo plano (con reconexión automática)"""
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+    
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None
+    
+    def publish(self, topic: str, data: Any) -> bool:
+        """Publica sin bloquear. Retorna: False si no hay conexión o el broker no lee"""
+        writer = self._writer
+        if writer is None:
+            return False
+        if writer.transport.get_write_buffer_size() > MAX_WRITE_BUFFER:
+            log.warning("Bus: buffer lleno, evento '%s' descartado", topic)
+            return False
+        line = json.dumps({'topic': topic, 'origin': self.worker_id, 'data': data})
+        writer.write(line.encode() + b'\n')
+        return True
+    
+    async def _run(self) -> None:
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path, limit=LINE_LIMIT)
+                self._writer = writer
+                log.info("Worker %s conectado al bus %s", self.worker_id, self.path)
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    await self._dispatch(line)
+            except asyncio.CancelledError:
+                raise
+            except (OSError, ValueError) as e:
+                log.warning("Bus no disponible (%s), reintentando...", e)
+            finally:
+                if self._writer is not None:
+                    self._writer.close()
+                self._writer = None
+            await asyncio.sleep(self.reconnect_delay)
+    
+    async def _dispatch(self, line: bytes) -> None:
+        try:
+            event = json.loads(line)
+        except ValueError:
+            return
+        if event.get('origin') == self.worker_id:
+            return
+        for handler in self._handlers.get(event.get('topic'), []):
+            try:
+                await handler(event.get('data'))
+            except Exception as e:
+                log.error("Error en handler del bus '%s': %s", event.get('topic'), e)
@@ -0,0 +1,172 @@
+"""Snapshot en memoria del catálogo de productos"""
+import os
+import time
+import uuid
+import bisect
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+
+from models import Frame
+
+
+class CatalogSnapshot:
+    """
+    Copia del catálogo ordenada por idProducto con la respuesta `products`
+    ya codificada. Se actualiza de forma incremental y caduca tras `max_age`.
+    
+    Cada cambio incrementa `version` y queda en un log acotado, lo que permite
+    responder deltas a clientes que se reconectan. La versión parte de la hora
+    de arranque en milisegundos para seguir creciendo entre reinicios, pero
+    cada worker lleva la suya: `epoch` identifica la instancia y una versión
+    solo es comparable dentro del mismo epoch.
+    """
+    
+    def __init__(self, max_age: Optional[float] = None, changelog_size: Optional[int] = None):
+        self.max_age = max_age if max_age is not None else float(os.getenv('CATALOG_MAX_AGE', '60'))
+        self._rows: List[Dict[str, Any]] = []
+        self._ids: List[int] = []
+        self._frame: Optional[Frame] = None
+        self._loaded_at: Optional[float] = None
+        self._has_data = False
+        # Cambios recibidos mientras una recarga completa está en curso
+        self._pending: Optional[List[Dict[str, Any]]] = None
+        # Invalidado durante la recarga: su resultado ya nace obsoleto
+        self._stale_load = False
+        
+        self.epoch = uuid.uuid4().hex[:12]
+        self.version = int(time.time() * 1000)
+        size = changelog_size or int(os.getenv('CATALOG_CHANGELOG_SIZE', '5000'))
+        self._log: deque = deque(maxlen=size)  # (version, idProducto)
+        # Versiones anteriores a esta ya no se pueden reconstruir desde el log
+        self._log_floor = self.version
+    
+    def is_fresh(self) -> bool:
+        """True si el snapshot está cargado y no superó la cota de antigüedad"""
+        if self._loaded_at is None:
+            return False
+        return time.monotonic() - self._loaded_at < self.max_age
+    
+    def begin_load(self) -> None:
+        """Marca el inicio de una recarga para no perder cambios concurrentes"""
+        self._pending = []
+        self._stale_load = False
+    
+    def abort_load(self) -> None:
+        """La recarga falló: se descartan los cambios acumulados y el snapshot queda obsoleto"""
+        self._pending = None
+        self._stale_load = False
+        self._frame = None
+        self._loaded_at = None
+    
+    def load(self, products: List[Dict[str, Any]]) -> None:
+        """Reemplaza el snapshot con el resultado de una lectura completa"""
+        rows = sorted(products, key=lambda p: p['idProducto'])
+        ids = [p['idProducto'] for p in rows]
+        
+        self.version += 1
+        if self._has_data:
+            # Diferencia contra el snapshot anterior: altas, cambios y bajas
+            previous = dict(zip(self._ids, self._rows))
+            current = set(ids)
+            for product_id, row in zip(ids, rows):
+                if previous.get(product_id) != row:
+                    self._record(product_id)
+            for product_id in previous.keys() - current:
+                self._record(product_id)
+        else:
+            self._log.clear()
+            self._log_floor = self.version
+        
+        self._rows = rows
+        self._ids = ids
+        self._frame = None
+        # Si se invalidó mientras se leía, se sirve pero la próxima lectura recarga
+        self._loaded_at = None if self._stale_load else time.monotonic()
+        self._stale_load = False
+        self._has_data = True
+        
+        pending, self._pending = self._pending, None
+        if pending:
+            self.apply(pending)
+    
+    def apply(self, products: List[Dict[str, Any]]) -> None:
+        """Inserta o reemplaza filas nuevas o modificadas"""
+        if self._pending is not None:
+            self._pending.extend(products)
+            return
+        if not self._has_data or not products:
+            return
+        
+        self.version += 1
+        for product in products:
+            product_id = product.get('idProducto')
+            if product_id is None:
+                continue
+            pos = bisect.bisect_left(self._ids, product_id)
+            if pos < len(self._ids) and self._ids[pos] == product_id:
+                self._rows[pos] = product
+            else:
+                self._ids.insert(pos, product_id)
+                self._rows.insert(pos, product)
+            self._record(product_id)
+        self._frame = None
+    
+    def invalidate(self) -> None:
+        """
+        Marca el snapshot como obsoleto; la próxima lectura recarga desde la BD.
+        Las filas se conservan para calcular el delta contra la recarga. Con una
+        recarga en curso se siguen acumulando los cambios y su resultado queda
+        marcado como obsoleto.
+        """
+        self._frame = None
+        self._loaded_at = None
+        if self._pending is not None:
+            self._stale_load = True
+    
+    def changes_since(self, version: int, max_rows: int) -> Optional[Tuple[List[Dict[str, Any]], List[int]]]:
+        """
+        Filas cambiadas e IDs eliminados después de `version`.
+        Retorna None si el log ya no cubre esa versión o el delta supera `max_rows`.
+        """
+        if version > self.version or version < self._log_floor:
+            return None
+        
+        changed = set()
+        for entry_version, product_id in reversed(self._log):
+            if entry_version <= version:
+                break
+            changed.add(product_id)
+            if len(changed) > max_rows:
+                return None
+        
+        rows = []
+        deleted = []
+        for product_id in sorted(changed):
+            pos = bisect.bisect_left(self._ids, product_id)
+            if pos < len(self._ids) and self._ids[pos] == product_id:
+                rows.append(self._rows[pos])
+            else:
+                deleted.append(product_id)
+        return rows, deleted
+    
+    def page(self, after: int, limit: int) -> List[Dict[str, Any]]:
+        """Página por keyset: hasta `limit` filas con idProducto > after"""
+        start = bisect.bisect_right(self._ids, after)
+        return self._rows[start:start + limit]
+    
+    def __len__(self) -> int:
+        return len(self._rows)
+    
+    def frame(self) -> Frame:
+        """Respuesta `products` codificada, reconstruida solo tras cambios"""
+        if self._frame is None:
+            self._frame = Frame({
+                'type': 'products', 'data': list(self._rows), 'version': self.version, 'epoch': self.epoch
+            })
+        return self._frame
+    
+    def _record(self, product_id: int) -> None:
+        if len(self._log) == self._log.maxlen:
+            # La entrada más antigua se descarta: el log ya no cubre esa versión
+            self._log_floor = self._log[0][0]
+        self._log.append((self.version, product_id))
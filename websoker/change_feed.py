@@ -0,0 +1,223 @@
+"""Feed de cambios de productos vía PostgreSQL LISTEN/NOTIFY"""
+import os
+import json
+import socket
+import asyncio
+from typing import Callable, List, Optional, Dict, Any
+
+from config import get_db_connection
+from logs import get_logger
+
+
+log = get_logger(__name__)
+
+
+CHANNEL = 'producto_changes'
+TRIGGER_NAME = 'producto_change_notify'
+
+# El payload solo lleva la operación y el id: pg_notify limita el tamaño a 8000 bytes
+TRIGGER_SQL = f"""
+CREATE OR REPLACE FUNCTION notify_producto_change() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify(
+        '{CHANNEL}',
+        json_build_object('op', TG_OP, 'id', NEW."idProducto")::text
+    );
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS {TRIGGER_NAME} ON producto;
+CREATE TRIGGER {TRIGGER_NAME}
+    AFTER INSERT OR UPDATE ON producto
+    FOR EACH ROW EXECUTE FUNCTION notify_producto_change();
+"""
+
+
+def install_trigger(conn) -> None:
+    """Migración: instala (o reemplaza) el trigger que publica cambios de producto"""
+    cur = conn.cursor()
+    try:
+        cur.execute(TRIGGER_SQL)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def trigger_installed(conn) -> bool:
+    """True si el trigger que publica cambios de producto existe en la BD"""
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            "SELECT 1 FROM pg_trigger WHERE tgname = %s AND tgrelid = 'producto'::regclass",
+            (TRIGGER_NAME,)
+        )
+        return cur.fetchone() is not None
+    finally:
+        cur.close()
+
+
+class ChangeFeedLost(Exception):
+    """La conexión LISTEN se perdió; hay que reconectar y hacer catch-up"""
+
+
+class ProductChangeFeed:
+    """Escucha notificaciones de cambios en producto sin hacer polling"""
+    
+    def __init__(self, factory: Optional[Callable] = None, channel: str = CHANNEL):
+        listen_port = os.getenv('DB_LISTEN_PORT')
+        self.factory = factory or (lambda: get_db_connection(port=listen_port))
+        self.channel = channel
+        # La conexión por defecto (DB_PORT) suele ser el pooler de transacciones,
+        # que acepta LISTEN pero no entrega notificaciones: sin DB_LISTEN_PORT
+        # (puerto en modo sesión o directo) el feed queda en polling
+        self.enabled = (
+            os.getenv('CHANGE_FEED_ENABLED', 'true').lower() == 'true'
+            and (factory is not None or listen_port is not None)
+        )
+        self.connection = None
+        self._events: asyncio.Queue = asyncio.Queue()
+        self._fd: Optional[int] = None  # solo se asigna si add_reader tuvo éxito
+    
+    @staticmethod
+    def supported() -> bool:
+        """
+        Verifica que el event loop acepte add_reader (ProactorEventLoop, el
+        predeterminado en Windows, no lo implementa). Se consulta una vez al inicio.
+        """
+        loop = asyncio.get_running_loop()
+        probe, peer = socket.socketpair()
+        try:
+            loop.add_reader(probe.fileno(), lambda: None)
+            loop.remove_reader(probe.fileno())
+            return True
+        except NotImplementedError:
+            return False
+        finally:
+            probe.close()
+            peer.close()
+    
+    async def trigger_ready(self) -> Optional[bool]:
+        """Verifica que el trigger esté instalado. Retorna None si no se pudo consultar"""
+        try:
+            return await asyncio.get_running_loop().run_in_executor(None, self._trigger_ready)
+        except Exception as e:
+            log.warning("No se pudo verificar el trigger de productos: %s", e)
+            return None
+    
+    def _trigger_ready(self) -> Optional[bool]:
+        conn = self.factory()
+        if conn is None:
+            return None
+        try:
+            return trigger_installed(conn)
+        finally:
+            conn.close()
+    
+    async def start(self) -> bool:
+        """Abre una conexión dedicada y ejecuta LISTEN"""
+        if not self.enabled:
+            return False
+        await self.stop()
+        loop = asyncio.get_running_loop()
+        try:
+            self.connection = await loop.run_in_executor(None, self._listen)
+            if self.connection is None:
+                return False
+            self._events = asyncio.Queue()
+            fd = self.connection.fileno()
+            loop.add_reader(fd, self._on_readable)
+            self._fd = fd
+            log.info("Escuchando cambios de productos en '%s'", self.channel)
+            return True
+        except Exception as e:
+            log.warning("No se pudo iniciar LISTEN '%s': %s", self.channel, e)
+            await self.stop()
+            return False
+    
+    async def stop(self) -> None:
+        """Deja de escuchar y cierra la conexión dedicada"""
+        if self._fd is not None:
+            asyncio.get_running_loop().remove_reader(self._fd)
+            self._fd = None
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+            self.connection = None
+    
+    async def wait(self, timeout: float) -> List[Dict[str, Any]]:
+        """
+        Espera el siguiente lote de eventos y drena los que ya llegaron.
+        Retorna [] si vence el timeout; lanza ChangeFeedLost si la conexión cayó.
+        """
+        try:
+            first = await asyncio.wait_for(self._events.get(), timeout=timeout)
+        except asyncio.TimeoutError:
+            await self._check()
+            return []
+        
+        events = [first]
+        while not self._events.empty():
+            events.append(self._events.get_nowait())
+        if any(event is None for event in events):
+            raise ChangeFeedLost()
+        return events
+    
+    def _listen(self):
+        conn = self.factory()
+        if conn is None:
+            return None
+        conn.autocommit = True
+        cur = conn.cursor()
+        cur.execute(f'LISTEN {self.channel}')
+        cur.close()
+        return conn
+    
+    def _on_readable(self) -> None:
+        """Callback del event loop: el socket de la conexión tiene datos"""
+        try:
+            self.connection.poll()
+        except Exception as e:
+            log.warning("Conexion LISTEN perdida: %s", e)
+            asyncio.get_running_loop().remove_reader(self._fd)
+            self._fd = None
+            self._events.put_nowait(None)
+            return
+        self._drain_notifies()
+    
+    def _drain_notifies(self) -> None:
+        while self.connection.notifies:
+            notify = self.connection.notifies.pop(0)
+            try:
+                event = json.loads(notify.payload)
+            except (TypeError, ValueError):
+                continue
+            self._events.put_nowait(event)
+    
+    async def _check(self) -> None:
+        """Health check de la conexión LISTEN durante periodos sin eventos"""
+        if self.connection is None or self._fd is None:
+            raise ChangeFeedLost()
+        
+        loop = asyncio.get_running_loop()
+        loop.remove_reader(self._fd)
+        try:
+            await loop.run_in_executor(None, self._ping)
+        except Exception as e:
+            log.warning("Health check LISTEN fallido: %s", e)
+            self._fd = None
+            raise ChangeFeedLost()
+        loop.add_reader(self._fd, self._on_readable)
+        self._drain_notifies()
+    
+    def _ping(self) -> None:
+        cur = self.connection.cursor()
+        try:
+            cur.execute('SELECT 1')
+        finally:
+            cur.close()
@@ -0,0 +1,100 @@
+"""Historial acotado por canal para reanudar sesiones tras una reconexión"""
+import os
+import uuid
+from collections import OrderedDict, deque
+from typing import Any, Dict, List, Optional, Tuple
+
+from models import Frame
+
+
+class _ChannelLog:
+    __slots__ = ('last_seq', 'floor', 'messages', 'bytes')
+    
+    def __init__(self, floor: int):
+        self.last_seq = floor
+        # Mensajes con seq > floor siguen en el buffer
+        self.floor = floor
+        self.messages: deque = deque()  # (seq, Frame)
+        self.bytes = 0
+
+
+class ChannelHistory:
+    """
+    Numera los mensajes de cada canal y guarda los últimos `size` en un
+    ring buffer. `epoch` identifica esta instancia: tras un reinicio (u
+    otro worker) las secuencias anteriores ya no son comparables.
+    
+    La secuencia es creciente para toda la instancia (no se reinicia por
+    canal). A un canal sin historial se le informa el seq global actual, y
+    los canales nuevos parten con el mayor seq de los descartados como
+    `floor`: solo hay hueco si el canal pudo tener mensajes que ya no están.
+    
+    Además del número de mensajes, la memoria se acota por bytes (tamaño del
+    JSON de cada frame): `max_bytes` por canal y `total_bytes` entre todos;
+    al superar el total se descartan los canales menos usados.
+    """
+    
+    def __init__(self, size: Optional[int] = None, max_channels: Optional[int] = None,
+                 max_bytes: Optional[int] = None, total_bytes: Optional[int] = None):
+        self.size = size or int(os.getenv('CHANNEL_HISTORY_SIZE', '256'))
+        self.max_channels = max_channels or int(os.getenv('CHANNEL_HISTORY_MAX_CHANNELS', '10000'))
+        self.max_bytes = max_bytes or int(os.getenv('CHANNEL_HISTORY_MAX_BYTES', '1048576'))
+        self.total_bytes = total_bytes or int(os.getenv('CHANNEL_HISTORY_TOTAL_BYTES', '67108864'))
+        self.epoch = uuid.uuid4().hex[:12]
+        self._channels: OrderedDict = OrderedDict()  # canal -> _ChannelLog (LRU)
+        self._seq = 0
+        self._evicted_seq = 0  # mayor last_seq de los canales descartados
+        self._bytes = 0
+    
+    def record(self, channel: str, message: Dict[str, Any]) -> Frame:
+        """Asigna el siguiente `seq` del canal y guarda el mensaje. Retorna: el frame numerado"""
+        log = self._channels.get(channel)
+        if log is None:
+            log = self._channels[channel] = _ChannelLog(self._evicted_seq)
+            if len(self._channels) > self.max_channels:
+                self._evict_oldest()
+        else:
+            self._channels.move_to_end(channel)
+        
+        self._seq += 1
+        log.last_seq = self._seq
+        frame = Frame({**message, 'seq': log.last_seq})
+        size = len(frame.data)
+        log.messages.append((log.last_seq, frame))
+        log.bytes += size
+        self._bytes += size
+        
+        while log.messages and (len(log.messages) > self.size or log.bytes > self.max_bytes):
+            seq, dropped = log.messages.popleft()
+            log.floor = seq
+            log.bytes -= len(dropped.data)
+            self._bytes -= len(dropped.data)
+        # El canal actual es el más reciente: se descarta último
+        while self._bytes > self.total_bytes and len(self._channels) > 1:
+            self._evict_oldest()
+        return frame
+    
+    def _evict_oldest(self) -> None:
+        _, evicted = self._channels.popitem(last=False)
+        self._evicted_seq = max(self._evicted_seq, evicted.last_seq)
+        self._bytes -= evicted.bytes
+    
+    def last_seq(self, channel: str) -> int:
+        log = self._channels.get(channel)
+        return log.last_seq if log is not None else self._seq
+    
+    def since(self, channel: str, seq: int) -> Tuple[List[Dict[str, Any]], bool]:
+        """
+        Mensajes del canal posteriores a `seq`.
+        Retorna: (mensajes, gap) con gap=True si alguno ya salió del buffer
+        """
+        log = self._channels.get(channel)
+        if log is None:
+            # Canal sin historial (o descartado): hueco si un descartado pudo tener mensajes posteriores
+            return [], seq > self._seq or seq < self._evicted_seq
+        if seq > log.last_seq:
+            return [], True
+        
+        gap = seq < log.floor
+        messages = [frame.message for message_seq, frame in log.messages if message_seq > seq]
+        return messages, gap
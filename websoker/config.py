@@ -4,8 +4,10 @@ from dotenv import load_dotenv
 import os
 import psycopg2
 from psycopg2.extras import RealDictCursor
+from logs import get_logger
 
 load_dotenv()
+log = get_logger(__name__)
 
 # PostgreSQL directo
 DB_HOST = os.getenv("DB_HOST")
@@ -16,19 +18,19 @@ DB_NAME = os.getenv("DB_NAME")
 DB_SSL = os.getenv("DB_SSL", "false").lower() == "true"
 
 # Función para conectar a PostgreSQL
-def get_db_connection():
+def get_db_connection(port=None):
     try:
         conn = psycopg2.connect(
             host=DB_HOST,
-            port=int(DB_PORT),
+            port=int(port or DB_PORT),
             user=DB_USER,
             password=DB_PASS,
             database=DB_NAME,
             sslmode="require" if DB_SSL else "prefer"
         )
-        print("PostgreSQL conectado")
+        log.info("PostgreSQL conectado")
         return conn
     except Exception as e:
-        print(f"Error conectando a PostgreSQL: {e}")
+        log.error("Error conectando a PostgreSQL: %s", e)
         return None
 
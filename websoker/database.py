@@ -1,119 +1,423 @@
 """Manejador de bases de datos"""
-from typing import Optional, List, Dict, Any
-from psycopg2.extras import RealDictCursor
-from config import get_db_connection
-from utils import convert_to_json_compatible
+import asyncio
+import os
+import uuid
+from functools import lru_cache
+from typing import Optional, List, Dict, Any, Callable, Iterable, Set, AsyncIterator, Tuple
+import psycopg2
+from psycopg2.extensions import DECIMAL, new_type, register_type
+from psycopg2.extras import execute_values
+from pool import ConnectionPool, PoolError, CONNECTION_ERRORS
+from write_behind import WriteBehindQueue
+from catalog import CatalogSnapshot
+from models import Frame
+from logs import get_logger
+
+
+log = get_logger(__name__)
+
+
+# Columnas de producto en el orden en que se seleccionan (y se arman las filas)
+PRODUCT_COLUMNS: Tuple[str, ...] = (
+    'idProducto',
+    'nombreProducto',
+    'descripcion',
+    'precio',
+    'stock',
+    'imagenURL',
+    'emprendedorIdEmprendedor',
+    'categoriaIdCategoria',
+)
+_PRODUCT_FIELDS = ', '.join(f'"{c}"' for c in PRODUCT_COLUMNS)
+SELECT_PRODUCTS = f'SELECT {_PRODUCT_FIELDS} FROM producto'
+
+# NUMERIC llega como float, listo para JSON (sin Decimal ni conversión posterior)
+NUMERIC_AS_FLOAT = new_type(
+    DECIMAL.values, 'NUMERIC_AS_FLOAT',
+    lambda value, cur: float(value) if value is not None else None
+)
+
+
+def register_row_types(conn) -> None:
+    """Typecasters de las conexiones del pool (se registra una vez por conexión)"""
+    register_type(NUMERIC_AS_FLOAT, conn)
+
+
+def product_rows(rows: Iterable[tuple]) -> List[Dict[str, Any]]:
+    """Filas (tuplas en el orden de PRODUCT_COLUMNS) como dicts listos para JSON"""
+    return [dict(zip(PRODUCT_COLUMNS, row)) for row in rows]
 
 
 class DatabaseManager:
     """Gestor de operaciones de base de datos"""
     
-    def __init__(self):
-        self.connection = None
+    def __init__(self, connection_factory: Optional[Callable] = None, pool_size: Optional[int] = None):
+        self.pool = ConnectionPool(factory=connection_factory, size=pool_size, on_connect=register_row_types)
+        self.connected = False
         self.last_product_id = 0
+        # IDs creados por este servidor y ya anunciados a los clientes
+        self._announced_ids: Set[int] = set()
+        self.catalog = CatalogSnapshot()
+        self._catalog_reload: Optional[asyncio.Future] = None
+        # Opcional: add_product concurrentes se agrupan en un commit por lote
+        self.write_behind: Optional[WriteBehindQueue] = None
+        if os.getenv('WRITE_BEHIND_ENABLED', 'false').lower() == 'true':
+            self.write_behind = WriteBehindQueue(
+                self._flush_inserts,
+                max_batch=int(os.getenv('WRITE_BEHIND_MAX_BATCH', '100')),
+                window=float(os.getenv('WRITE_BEHIND_WINDOW', '0.02'))
+            )
     
-    def connect(self) -> bool:
-        """Conecta a la base de datos"""
+    async def connect(self) -> bool:
+        """Abre el pool de conexiones a la base de datos"""
         try:
-            self.connection = get_db_connection()
-            self._initialize_last_product_id()
-            print("Conexion a BD establecida")
+            if not await self.pool.open():
+                return False
+            self.connected = True
+            await self._initialize_last_product_id()
+            log.info("Pool de BD establecido (%s conexiones)", self.pool.size)
             return True
         except Exception as e:
-            print(f"Error conectando a BD: {e}")
+            log.error("Error conectando a BD: %s", e)
             return False
     
-    def _initialize_last_product_id(self) -> None:
+    async def _initialize_last_product_id(self) -> None:
         """Inicializa el último ID de producto visto"""
         try:
-            cur = self.connection.cursor()
-            cur.execute('SELECT MAX("idProducto") FROM producto')
-            result = cur.fetchone()
-            self.last_product_id = int(result[0]) if result[0] else 0
-            print(f"Ultimo ID de producto: {self.last_product_id}")
+            self.last_product_id = await self.pool.run(self._fetch_max_product_id)
+            log.info("Ultimo ID de producto: %s", self.last_product_id)
         except Exception as e:
-            print(f"Error inicializando last_product_id: {e}")
+            log.error("Error inicializando last_product_id: %s", e)
     
-    def get_all_products(self) -> Optional[List[Dict[str, Any]]]:
+    async def get_all_products(self) -> Optional[List[Dict[str, Any]]]:
         """Obtiene todos los productos"""
         try:
-            if not self.connection:
+            if not self.connected:
                 return None
-            
-            cur = self.connection.cursor(cursor_factory=RealDictCursor)
-            cur.execute('SELECT * FROM producto ORDER BY "idProducto"')
-            products = cur.fetchall()
-            return [convert_to_json_compatible(dict(row)) for row in products]
+            return await self.pool.run(self._fetch_all_products)
         except Exception as e:
-            print(f"Error obteniendo productos: {e}")
-            if self.connection:
-                self.connection.rollback()
+            log.error("Error obteniendo productos: %s", e)
+            return None
+    
+    async def get_products_frame(self) -> Optional[Frame]:
+        """Respuesta `products` servida desde el snapshot en memoria"""
+        if self.catalog.is_fresh():
+            return self.catalog.frame()
+        
+        # Una sola recarga aunque muchas pestañas pidan el catálogo a la vez
+        if self._catalog_reload is None:
+            self._catalog_reload = asyncio.ensure_future(self._reload_catalog())
+        reload = self._catalog_reload
+        try:
+            return await asyncio.shield(reload)
+        finally:
+            if reload.done() and self._catalog_reload is reload:
+                self._catalog_reload = None
+    
+    async def get_catalog(self) -> Optional[CatalogSnapshot]:
+        """Snapshot del catálogo, recargado si superó la cota de antigüedad"""
+        if not self.catalog.is_fresh() and await self.get_products_frame() is None:
+            return None
+        return self.catalog
+    
+    async def _reload_catalog(self) -> Optional[Frame]:
+        self.catalog.begin_load()
+        products = await self.get_all_products()
+        if products is None:
+            self.catalog.abort_load()
             return None
+        self.catalog.load(products)
+        return self.catalog.frame()
     
-    def get_new_products(self) -> Optional[List[Dict[str, Any]]]:
+    async def get_products_page(self, after: int, limit: int) -> Optional[List[Dict[str, Any]]]:
+        """Página de productos por keyset sobre "idProducto" """
+        try:
+            if self.catalog.is_fresh():
+                return self.catalog.page(after, limit)
+            if not self.connected:
+                return None
+            return await self.pool.run(self._fetch_products_page, after, limit)
+        except Exception as e:
+            log.error("Error obteniendo pagina de productos: %s", e)
+            return None
+    
+    async def stream_products(self, chunk_size: int, after: int = 0) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        Recorre el catálogo en bloques con un cursor del lado del servidor.
+        Solo un bloque vive en memoria: el siguiente se lee cuando el consumidor
+        pide más, así la memoria no depende del tamaño de la tabla.
+        Lanza PoolError sin conexión: un stream vacío se leería como catálogo vacío.
+        """
+        if not self.connected:
+            raise PoolError('Sin conexion a la base de datos')
+        async with self.pool.session() as session:
+            cur = await session.run(self._open_products_cursor, after, chunk_size)
+            try:
+                while True:
+                    rows = await session.run(self._fetch_chunk, cur, chunk_size)
+                    if not rows:
+                        break
+                    yield rows
+            finally:
+                await session.run(self._close_cursor, cur)
+    
+    def invalidate_catalog(self) -> None:
+        """Invalida el snapshot del catálogo (p. ej. si se perdieron eventos)"""
+        self.catalog.invalidate()
+    
+    async def get_new_products(self) -> Optional[List[Dict[str, Any]]]:
         """Obtiene productos nuevos desde el último ID visto"""
         try:
-            if not self.connection:
+            if not self.connected:
                 return None
             
-            cur = self.connection.cursor(cursor_factory=RealDictCursor)
-            cur.execute(
-                'SELECT * FROM producto WHERE "idProducto" > %s ORDER BY "idProducto"',
-                (self.last_product_id,)
-            )
-            products = cur.fetchall()
-            
-            if products:
-                result = [convert_to_json_compatible(dict(row)) for row in products]
+            result = await self.pool.run(self._fetch_products_after, self.last_product_id)
+            if result:
                 # Actualizar último ID
                 new_ids = [p.get('idProducto') for p in result]
-                self.last_product_id = max(new_ids) if new_ids else self.last_product_id
-                return result
-            
-            return []
+                self.last_product_id = max(self.last_product_id, max(new_ids))
+                self.catalog.apply(result)
+            return result
+        except Exception as e:
+            log.error("Error obteniendo productos nuevos: %s", e)
+            return None
+    
+    def take_unannounced(self, products: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Filtra los productos que add_product ya difundió en este proceso"""
+        if not self._announced_ids:
+            return products
+        result = [p for p in products if p.get('idProducto') not in self._announced_ids]
+        self._announced_ids = {i for i in self._announced_ids if i > self.last_product_id}
+        return result
+    
+    def observe_products(self, products: List[Dict[str, Any]]) -> None:
+        """Registra productos detectados por otro worker (watermark y snapshot)"""
+        ids = [p.get('idProducto') for p in products if p.get('idProducto') is not None]
+        if ids:
+            self.last_product_id = max(self.last_product_id, max(ids))
+        self.catalog.apply(products)
+    
+    async def get_products_by_ids(self, ids: Iterable[int]) -> Optional[List[Dict[str, Any]]]:
+        """Obtiene los productos con los IDs indicados"""
+        try:
+            if not self.connected:
+                return None
+            result = await self.pool.run(self._fetch_products_by_ids, sorted(set(ids)))
+            self.catalog.apply(result)
+            return result
         except Exception as e:
-            print(f"Error obteniendo productos nuevos: {e}")
-            if self.connection:
-                self.connection.rollback()
+            log.error("Error obteniendo productos por id: %s", e)
             return None
     
-    def create_product(self, product_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    async def create_product(self, product_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """Crea un nuevo producto"""
         try:
-            if not self.connection:
+            if not self.connected:
                 return None
             
-            # Asignar valores por defecto
-            if 'imagenURL' not in product_data:
-                product_data['imagenURL'] = ''
-            if 'stock' not in product_data:
-                product_data['stock'] = 1
+            self._apply_defaults(product_data)
             
-            cur = self.connection.cursor(cursor_factory=RealDictCursor)
-            
-            # Construir SQL dinámico
-            columns = ', '.join(f'"{k}"' for k in product_data.keys())
-            placeholders = ', '.join(['%s'] * len(product_data))
-            sql = f'INSERT INTO producto ({columns}) VALUES ({placeholders}) RETURNING *'
+            if self.write_behind is not None:
+                created = await self.write_behind.submit(product_data)
+            else:
+                # Un INSERT no es idempotente: no se reintenta si la conexión cae
+                created = await self.pool.run(self._insert_product, product_data, retry=False)
+            if created:
+                self._register_created([created])
+            return created
+        except Exception as e:
+            log.error("Error creando producto: %s", e)
+            return None
+    
+    async def create_products(self, products: List[Dict[str, Any]]) -> Optional[List[Dict[str, Any]]]:
+        """
+        Crea varios productos en una sola transacción (todos o ninguno).
+        Retorna: las filas creadas, o None si falló
+        """
+        try:
+            if not self.connected:
+                return None
             
-            cur.execute(sql, tuple(product_data.values()))
-            self.connection.commit()
+            # Un INSERT multi-fila por cada conjunto de columnas distinto
+            groups: Dict[Tuple[str, ...], List[tuple]] = {}
+            for product_data in products:
+                self._apply_defaults(product_data)
+                columns = tuple(sorted(product_data))
+                groups.setdefault(columns, []).append(tuple(product_data[c] for c in columns))
             
-            result = cur.fetchone()
-            if result:
-                return convert_to_json_compatible(dict(result))
-            return None
+            created = await self.pool.run(self._insert_products, groups, retry=False)
+            self._register_created(created)
+            return created
         except Exception as e:
-            print(f"Error creando producto: {e}")
-            if self.connection:
-                self.connection.rollback()
+            log.error("Error creando productos: %s", e)
             return None
     
-    def close(self) -> None:
-        """Cierra la conexión a BD"""
-        if self.connection:
-            try:
-                self.connection.close()
-                print("Conexion a BD cerrada")
-            except Exception as e:
-                print(f"Error cerrando conexion: {e}")
+    async def _flush_inserts(self, batch: List[Dict[str, Any]]) -> List[Any]:
+        """Escribe un lote de la cola write-behind en una sola transacción"""
+        return await self.pool.run(self._insert_batch, batch, retry=False)
+    
+    @staticmethod
+    def _apply_defaults(product_data: Dict[str, Any]) -> None:
+        """Asignar valores por defecto"""
+        if 'imagenURL' not in product_data:
+            product_data['imagenURL'] = ''
+        if 'stock' not in product_data:
+            product_data['stock'] = 1
+    
+    def _register_created(self, created: List[Dict[str, Any]]) -> None:
+        """Anota productos creados aquí para no volver a difundirlos desde el feed"""
+        for product in created:
+            if product.get('idProducto') is not None:
+                self._announced_ids.add(product['idProducto'])
+        self.catalog.apply(created)
+    
+    async def close(self) -> None:
+        """Cierra el pool de conexiones a BD"""
+        try:
+            if self.write_behind is not None:
+                await self.write_behind.close()
+            await self.pool.close()
+            self.connected = False
+            log.info("Conexion a BD cerrada")
+        except Exception as e:
+            log.error("Error cerrando conexion: %s", e)
+    
+    # ---- Consultas ejecutadas en los hilos del pool ----
+    
+    @staticmethod
+    def _fetch_max_product_id(conn) -> int:
+        cur = conn.cursor()
+        cur.execute('SELECT MAX("idProducto") FROM producto')
+        result = cur.fetchone()
+        conn.rollback()
+        return int(result[0]) if result[0] else 0
+    
+    @staticmethod
+    def _fetch_all_products(conn) -> List[Dict[str, Any]]:
+        cur = conn.cursor()
+        cur.execute(SELECT_PRODUCTS + ' ORDER BY "idProducto"')
+        products = cur.fetchall()
+        conn.rollback()
+        return product_rows(products)
+    
+    @staticmethod
+    def _fetch_products_after(conn, last_id: int) -> List[Dict[str, Any]]:
+        cur = conn.cursor()
+        cur.execute(
+            SELECT_PRODUCTS + ' WHERE "idProducto" > %s ORDER BY "idProducto"',
+            (last_id,)
+        )
+        products = cur.fetchall()
+        conn.rollback()
+        return product_rows(products)
+    
+    @staticmethod
+    def _fetch_products_page(conn, after: int, limit: int) -> List[Dict[str, Any]]:
+        cur = conn.cursor()
+        cur.execute(
+            SELECT_PRODUCTS + ' WHERE "idProducto" > %s ORDER BY "idProducto" LIMIT %s',
+            (after, limit)
+        )
+        products = cur.fetchall()
+        conn.rollback()
+        return product_rows(products)
+    
+    @staticmethod
+    def _open_products_cursor(conn, after: int, chunk_size: int):
+        # Cursor con nombre: PostgreSQL entrega las filas bajo demanda (FETCH)
+        cur = conn.cursor(name=f'productos_{uuid.uuid4().hex}')
+        cur.itersize = chunk_size
+        cur.execute(
+            SELECT_PRODUCTS + ' WHERE "idProducto" > %s ORDER BY "idProducto"',
+            (after,)
+        )
+        return cur
+    
+    @staticmethod
+    def _fetch_chunk(conn, cur, chunk_size: int) -> List[Dict[str, Any]]:
+        return product_rows(cur.fetchmany(chunk_size))
+    
+    @staticmethod
+    def _close_cursor(conn, cur) -> None:
+        try:
+            cur.close()
+        except Exception:
+            pass
+    
+    @staticmethod
+    def _fetch_products_by_ids(conn, ids: List[int]) -> List[Dict[str, Any]]:
+        cur = conn.cursor()
+        cur.execute(
+            SELECT_PRODUCTS + ' WHERE "idProducto" = ANY(%s) ORDER BY "idProducto"',
+            (ids,)
+        )
+        products = cur.fetchall()
+        conn.rollback()
+        return product_rows(products)
+    
+    @staticmethod
+    def _insert_product(conn, product_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        cur = conn.cursor()
+        
+        sql = DatabaseManager._insert_sql(tuple(product_data.keys()))
+        cur.execute(sql, tuple(product_data.values()))
+        result = cur.fetchone()
+        conn.commit()
+        
+        if result:
+            return dict(zip(PRODUCT_COLUMNS, result))
+        return None
+    
+    @staticmethod
+    def _insert_batch(conn, batch: List[Dict[str, Any]]) -> List[Any]:
+        """
+        Inserta cada fila bajo su propio SAVEPOINT y confirma todo con un commit.
+        Retorna: la fila creada o la excepción de cada elemento, en orden
+        """
+        cur = conn.cursor()
+        results: List[Any] = []
+        try:
+            for product_data in batch:
+                cur.execute('SAVEPOINT write_behind')
+                try:
+                    cur.execute(DatabaseManager._insert_sql(tuple(product_data.keys())), tuple(product_data.values()))
+                    row = cur.fetchone()
+                    cur.execute('RELEASE SAVEPOINT write_behind')
+                except CONNECTION_ERRORS:
+                    raise
+                except psycopg2.Error as e:
+                    cur.execute('ROLLBACK TO SAVEPOINT write_behind')
+                    results.append(e)
+                    continue
+                results.append(dict(zip(PRODUCT_COLUMNS, row)) if row else None)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+        return results
+    
+    @staticmethod
+    def _insert_products(conn, groups: Dict[Tuple[str, ...], List[tuple]]) -> List[Dict[str, Any]]:
+        cur = conn.cursor()
+        created = []
+        try:
+            for columns, rows in groups.items():
+                sql = DatabaseManager._insert_sql(columns, multirow=True)
+                created.extend(product_rows(execute_values(cur, sql, rows, page_size=len(rows), fetch=True)))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+        return created
+    
+    @staticmethod
+    @lru_cache(maxsize=64)
+    def _insert_sql(columns: Tuple[str, ...], multirow: bool = False) -> str:
+        """SQL de INSERT por conjunto de columnas (se construye una sola vez)"""
+        names = ', '.join(f'"{c}"' for c in columns)
+        values = '%s' if multirow else '(' + ', '.join(['%s'] * len(columns)) + ')'
+        return f'INSERT INTO producto ({names}) VALUES {values} RETURNING {_PRODUCT_FIELDS}'
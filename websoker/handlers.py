@@ -1,63 +1,167 @@
 """Manejador de mensajes WebSocket"""
+import os
 import json
-from typing import Dict, Any, Optional, Callable
+import time
+from contextlib import aclosing
+from typing import Dict, Any, Optional, Callable, Union, Tuple
 import asyncio
-from models import Message
-from utils import parse_message, normalize_product
+from models import Message, Frame
+import wire
+from utils import normalize_product
+from idempotency import IdempotencyCache
+from subscriptions import PatternIndex
+from product_filters import ProductFilterIndex
+from channel_history import ChannelHistory
+import metrics
+from logs import get_logger, SAMPLED
+
+
+log = get_logger(__name__)
 
 
 class MessageHandler:
     """Procesa y responde mensajes WebSocket"""
     
-    def __init__(self, connection_manager, database_manager):
+    # Dependen del orden de llegada: nunca se procesan en paralelo
+    ORDERED_ACTIONS = frozenset({'subscribe', 'unsubscribe', 'resume', 'subscribe_products', 'unsubscribe_products'})
+    
+    def __init__(self, connection_manager, database_manager, broadcaster, presence, bus=None):
         self.connections = connection_manager
         self.db = database_manager
+        self.broadcaster = broadcaster
+        self.presence = presence
+        self.bus = bus
+        self.max_page_size = int(os.getenv('MAX_PAGE_SIZE', '500'))
+        self.stream_chunk_size = int(os.getenv('STREAM_CHUNK_SIZE', '500'))
+        self.max_delta_rows = int(os.getenv('MAX_DELTA_ROWS', '1000'))
+        self.max_bulk_products = int(os.getenv('MAX_BULK_PRODUCTS', '1000'))
+        # Estricto: JSON inválido se rechaza sin intentar repararlo
+        self.strict = os.getenv('PARSER_STRICT', 'false').lower() == 'true'
+        # idempotency_key -> respuesta (o futuro si la creación sigue en curso)
+        self.idempotency = IdempotencyCache()
+        # Mensajes recientes por canal, para `resume` tras una reconexión
+        self.history = ChannelHistory()
         self.handlers: Dict[str, Callable] = {
             'subscribe': self.handle_subscribe,
             'unsubscribe': self.handle_unsubscribe,
+            'resume': self.handle_resume,
+            'subscribe_products': self.handle_subscribe_products,
+            'unsubscribe_products': self.handle_unsubscribe_products,
             'ping': self.handle_ping,
             'get_products': self.handle_get_products,
             'add_product': self.handle_add_product,
+            'add_products': self.handle_add_products,
             'notify': self.handle_notify,
             'get_clients_count': self.handle_get_clients_count,
+            'batching': self.handle_batching,
+            'hello': self.handle_hello,
         }
+        # Series en cero desde el inicio para cada acción conocida
+        for action in self.handlers:
+            metrics.MESSAGES.inc(action, amount=0)
     
-    async def process_message(self, ws, raw_message: str) -> Optional[Dict[str, Any]]:
-        """Procesa un mensaje del cliente"""
-        # Parsear mensaje
-        success, data = parse_message(raw_message)
+    def decode(self, raw_message: Union[str, bytes], codec=None) -> Tuple[Optional[dict], Optional[dict]]:
+        """Parsea (con el codec de la conexión) y valida el sobre del mensaje. Retorna: (datos, error)"""
+        # Rechazo barato: acción desconocida sin parsear el resto del mensaje
+        action = wire.sniff_action(raw_message)
+        if action is not None and action not in self.handlers:
+            return None, {'error': f'Acción no reconocida: {action}'}
+        # Un arreglo nunca es un mensaje válido (ni reparado): evita parsear anidamientos enormes
+        if isinstance(raw_message, str) and raw_message[:64].lstrip()[:1] == '[':
+            return None, {'error': 'Mensaje debe ser un objeto JSON'}
+        
+        success, data = wire.parse(raw_message, codec, strict=self.strict)
         if not success:
-            return {'error': 'JSON inválido'}
+            return None, {'error': 'JSON inválido'}
         
         if not isinstance(data, dict):
-            return {'error': 'Mensaje debe ser un objeto JSON'}
+            return None, {'error': 'Mensaje debe ser un objeto JSON'}
         
-        # Obtener acción
-        action = data.get('action')
-        if not action:
-            return {'error': 'Falta "action" en el mensaje'}
+        if not data.get('action'):
+            return None, {'error': 'Falta "action" en el mensaje'}
+        return data, None
+    
+    def can_pipeline(self, data: dict) -> bool:
+        """Solo los mensajes con `id` (opt-in) y sin dependencia de orden"""
+        return data.get('id') is not None and data['action'] not in self.ORDERED_ACTIONS
+    
+    async def dispatch(self, ws, data: dict) -> Optional[Union[Frame, Dict[str, Any]]]:
+        """Ejecuta el handler de un mensaje ya parseado; la respuesta repite su `id`"""
+        action = data['action']
         
         # Buscar handler
         handler = self.handlers.get(action)
         if not handler:
-            return {'error': f'Acción no reconocida: {action}'}
+            metrics.MESSAGES.inc('unknown')
+            response = {'error': f'Acción no reconocida: {action}'}
+        else:
+            # Ejecutar handler
+            start = time.perf_counter()
+            try:
+                response = await handler(ws, data)
+            except Exception as e:
+                log.error("Error en handler %s: %s", action, e)
+                response = {'error': str(e)}
+            metrics.MESSAGES.inc(action)
+            metrics.HANDLER_SECONDS.observe(time.perf_counter() - start, action)
         
-        # Ejecutar handler
-        try:
-            return await handler(ws, data)
-        except Exception as e:
-            print(f"Error en handler {action}: {e}")
-            return {'error': str(e)}
+        request_id = data.get('id')
+        if response is None or request_id is None:
+            return response
+        if isinstance(response, Frame):
+            return response.with_fields(id=request_id)
+        return {**response, 'id': request_id}
     
     async def handle_subscribe(self, ws, data: dict) -> dict:
-        """Maneja suscripción a canal"""
+        """
+        Maneja suscripción a canal. Admite patrones por segmentos separados por '.':
+        '*' coincide con un segmento y '**' (al final) con uno o más.
+        """
         channel = data.get('channel')
         if not channel:
             return {'error': 'Falta "channel"'}
         
+        if PatternIndex.is_pattern(channel):
+            error = PatternIndex.validate(channel)
+            if error:
+                return {'error': error}
+        
         self.connections.subscribe(ws, channel)
-        print(f"Cliente suscrito al canal: {channel}")
-        return {'type': 'subscribed', 'channel': channel}
+        log.info("Cliente suscrito al canal: %s", channel, extra=SAMPLED)
+        # seq/epoch: punto de partida para un futuro `resume`
+        return {
+            'type': 'subscribed',
+            'channel': channel,
+            'seq': self.history.last_seq(channel),
+            'epoch': self.history.epoch
+        }
+    
+    async def handle_resume(self, ws, data: dict) -> dict:
+        """
+        Re-suscribe tras una reconexión y devuelve lo perdido por canal.
+        Espera `channels`: {canal: último seq recibido} y el `epoch` conocido.
+        Si el buffer ya no cubre ese seq (o cambió el epoch) el canal trae gap: true.
+        """
+        channels = data.get('channels')
+        if not isinstance(channels, dict) or not channels:
+            return {'error': 'Falta "channels" ({canal: último seq})'}
+        if any(isinstance(seq, bool) or not isinstance(seq, int) or seq < 0 for seq in channels.values()):
+            return {'error': 'Cada seq de "channels" debe ser un entero >= 0'}
+        
+        same_epoch = data.get('epoch') in (None, self.history.epoch)
+        result = {}
+        for channel, seq in channels.items():
+            if PatternIndex.is_pattern(channel):
+                return {'error': f'resume no admite patrones: {channel}'}
+            if same_epoch:
+                messages, gap = self.history.since(channel, seq)
+            else:
+                messages, gap = self.history.since(channel, 0)[0], True
+            # Suscribir en el mismo paso: nada publicado después queda fuera
+            self.connections.subscribe(ws, channel)
+            result[channel] = {'seq': self.history.last_seq(channel), 'gap': gap, 'messages': messages}
+        
+        return {'type': 'resumed', 'epoch': self.history.epoch, 'channels': result}
     
     async def handle_unsubscribe(self, ws, data: dict) -> dict:
         """Maneja desuscripción de canal"""
@@ -66,24 +170,214 @@ class MessageHandler:
             return {'error': 'Falta "channel"'}
         
         self.connections.unsubscribe(ws, channel)
-        print(f"Cliente desuscrito del canal: {channel}")
+        log.info("Cliente desuscrito del canal: %s", channel, extra=SAMPLED)
         return {'type': 'unsubscribed', 'channel': channel}
     
+    async def handle_subscribe_products(self, ws, data: dict) -> dict:
+        """
+        Filtra new_product/product_updated para este cliente por categoria,
+        emprendedor (entero o lista) y precio_min/precio_max.
+        """
+        filters, error = ProductFilterIndex.parse(data)
+        if error:
+            return {'error': error}
+        
+        self.connections.set_product_filter(ws, filters)
+        return {'type': 'products_subscribed', 'filters': filters}
+    
+    async def handle_unsubscribe_products(self, ws, data: dict) -> dict:
+        """Quita los filtros: el cliente vuelve a recibir todos los productos"""
+        self.connections.set_product_filter(ws, {})
+        return {'type': 'products_unsubscribed'}
+    
     async def handle_ping(self, ws, data: dict) -> dict:
         """Responde a ping"""
         return {'type': 'pong'}
     
-    async def handle_get_products(self, ws, data: dict) -> dict:
-        """Obtiene todos los productos"""
-        products = self.db.get_all_products()
-        if products is None:
+    async def handle_get_products(self, ws, data: dict) -> Union[Frame, dict]:
+        """
+        Obtiene productos.
+        - Sin parámetros: catálogo completo desde el snapshot en memoria
+        - limit/after: página por keyset sobre "idProducto"
+        - stream: true: catálogo en bloques `products_chunk` + `products_end`
+        - since (versión, con el `epoch` recibido) / since_id (id): solo lo cambiado, `products_delta`
+        """
+        if 'since' in data or 'since_id' in data:
+            return await self._products_delta(data)
+        
+        after, error = self._int_param(data, 'after', default=0, minimum=0)
+        if error:
+            return error
+        
+        if data.get('stream'):
+            chunk_size, error = self._int_param(
+                data, 'limit', default=self.stream_chunk_size, minimum=1, maximum=self.max_page_size
+            )
+            if error:
+                return error
+            return await self._stream_products(ws, after, chunk_size, data.get('id'))
+        
+        if 'limit' in data or 'after' in data:
+            limit, error = self._int_param(
+                data, 'limit', default=self.max_page_size, minimum=1, maximum=self.max_page_size
+            )
+            if error:
+                return error
+            products = await self.db.get_products_page(after, limit)
+            if products is None:
+                return {'error': 'Error accediendo a la base de datos'}
+            
+            next_after = products[-1]['idProducto'] if len(products) == limit else None
+            return {'type': 'products', 'data': products, 'after': after, 'next_after': next_after}
+        
+        frame = await self.db.get_products_frame()
+        if frame is None:
+            return {'error': 'Error accediendo a la base de datos'}
+        
+        log.info("Enviando %s productos", len(frame.message['data']), extra=SAMPLED)
+        return frame
+    
+    async def _products_delta(self, data: dict) -> dict:
+        """
+        Delta del catálogo desde una versión o un idProducto conocido por el cliente.
+        Una versión de otro worker (o sin `epoch`) no es comparable: responde resync.
+        """
+        catalog = await self.db.get_catalog()
+        if catalog is None:
+            return {'error': 'Error accediendo a la base de datos'}
+        
+        if 'since' in data:
+            since, error = self._int_param(data, 'since', default=0, minimum=0)
+            if error:
+                return error
+            delta = None
+            if data.get('epoch') == catalog.epoch:
+                delta = catalog.changes_since(since, self.max_delta_rows)
+            if delta is None:
+                return {
+                    'type': 'products_delta', 'resync': True, 'since': since,
+                    'version': catalog.version, 'epoch': catalog.epoch
+                }
+            products, deleted = delta
+            return {
+                'type': 'products_delta',
+                'resync': False,
+                'since': since,
+                'version': catalog.version,
+                'epoch': catalog.epoch,
+                'data': products,
+                'deleted': deleted
+            }
+        
+        since_id, error = self._int_param(data, 'since_id', default=0, minimum=0)
+        if error:
+            return error
+        products = catalog.page(since_id, self.max_delta_rows + 1)
+        if len(products) > self.max_delta_rows:
+            return {
+                'type': 'products_delta', 'resync': True, 'since_id': since_id,
+                'version': catalog.version, 'epoch': catalog.epoch
+            }
+        return {
+            'type': 'products_delta',
+            'resync': False,
+            'since_id': since_id,
+            'version': catalog.version,
+            'epoch': catalog.epoch,
+            'data': products,
+            'deleted': []
+        }
+    
+    async def _stream_products(self, ws, after: int, chunk_size: int, request_id=None) -> Optional[dict]:
+        """Envía el catálogo en bloques leídos bajo demanda desde un cursor con nombre"""
+        total = 0
+        chunks = 0
+        try:
+            async with aclosing(self.db.stream_products(chunk_size, after)) as stream:
+                async for rows in stream:
+                    # Esperar a que el bloque se escriba antes de leer el siguiente:
+                    # un solo bloque en vuelo por stream, aunque el cliente sea lento
+                    chunk = {'type': 'products_chunk', 'seq': chunks, 'data': rows}
+                    if request_id is not None:
+                        chunk['id'] = request_id
+                    if not await self.broadcaster.send(ws, chunk, flush=True):
+                        return None
+                    total += len(rows)
+                    chunks += 1
+        except Exception as e:
+            # Sin products_end: el cliente no debe tomar lo recibido como el catálogo completo
+            log.error("Error en stream de productos: %s", e)
             return {'error': 'Error accediendo a la base de datos'}
         
-        print(f"Enviando {len(products)} productos")
-        return {'type': 'products', 'data': products}
+        log.info("Enviados %s productos en %s bloque(s)", total, chunks, extra=SAMPLED)
+        return {'type': 'products_end', 'total': total, 'chunks': chunks}
+    
+    @staticmethod
+    def _int_param(data: dict, name: str, default: int, minimum: int,
+                   maximum: Optional[int] = None) -> Tuple[int, Optional[dict]]:
+        """Valida un parámetro entero opcional. Retorna: (valor, error)"""
+        value = data.get(name, default)
+        if value is None:
+            value = default
+        if isinstance(value, bool) or not isinstance(value, int) or value < minimum:
+            return default, {'error': f'"{name}" debe ser un entero >= {minimum}'}
+        if maximum is not None:
+            value = min(value, maximum)
+        return value, None
     
     async def handle_add_product(self, ws, data: dict) -> dict:
-        """Crea un nuevo producto"""
+        """Crea un nuevo producto (una sola vez por `idempotency_key`)"""
+        return await self._idempotent(data, self._create_product)
+    
+    async def handle_add_products(self, ws, data: dict) -> dict:
+        """Crea varios productos en una sola transacción (una sola vez por `idempotency_key`)"""
+        return await self._idempotent(data, self._create_products)
+    
+    async def _idempotent(self, data: dict, create: Callable) -> dict:
+        """
+        Ejecuta `create` una vez por clave. Un reintento (también concurrente)
+        recibe la misma respuesta desde memoria, sin escribir en BD ni difundir.
+        """
+        key = data.get('idempotency_key')
+        if key is None:
+            return await create(data)
+        if not isinstance(key, str) or not 0 < len(key) <= 200:
+            return {'error': '"idempotency_key" debe ser un texto de 1 a 200 caracteres'}
+        
+        key = f"{data['action']}:{key}"
+        while True:
+            entry = self.idempotency.get(key)
+            if entry is None:
+                break
+            # El original puede seguir en curso: se espera su resultado
+            response = await asyncio.shield(entry)
+            if response is not None:
+                return {**response, 'replayed': True}
+        
+        future = asyncio.get_running_loop().create_future()
+        self.idempotency.put(key, future)
+        response = None
+        try:
+            response = await create(data)
+            return response
+        finally:
+            if response is not None and response.get('status') == 'success':
+                future.set_result(response)
+                if self.bus is not None:
+                    self.bus.publish('idempotency', {'key': key, 'response': response})
+            else:
+                # Falló: un reintento debe poder volver a intentarlo
+                self.idempotency.discard(key)
+                future.set_result(None)
+    
+    async def on_bus_idempotency(self, data: dict) -> None:
+        """Clave resuelta en otro worker (el cliente puede reconectar a cualquiera)"""
+        if data.get('key') and isinstance(data.get('response'), dict):
+            future = asyncio.get_running_loop().create_future()
+            future.set_result(data['response'])
+            self.idempotency.put(data['key'], future)
+    
+    async def _create_product(self, data: dict) -> dict:
         product = data.get('product')
         if not product:
             return {'error': 'Falta "product"'}
@@ -100,17 +394,48 @@ class MessageHandler:
             return {'error': 'Producto vacío después de normalización'}
         
         # Crear en BD
-        created = self.db.create_product(normalized)
+        created = await self.db.create_product(normalized)
         if not created:
             return {'error': 'Error creando producto en BD'}
         
-        print(f"Producto creado: {created.get('nombreProducto')}")
+        log.info("Producto creado: %s", created.get('nombreProducto'))
         return {
             'type': 'add_product',
             'status': 'success',
             'data': [created]
         }
     
+    async def _create_products(self, data: dict) -> dict:
+        products = data.get('products')
+        if isinstance(products, str):
+            try:
+                products = json.loads(products)
+            except json.JSONDecodeError:
+                return {'error': 'Campo "products" no es JSON válido'}
+        
+        if not isinstance(products, list) or not products:
+            return {'error': 'Falta "products" (lista de productos)'}
+        if len(products) > self.max_bulk_products:
+            return {'error': f'Máximo {self.max_bulk_products} productos por mensaje'}
+        
+        normalized = []
+        for i, product in enumerate(products):
+            product = normalize_product(product)
+            if not product:
+                return {'error': f'Producto {i} vacío después de normalización'}
+            normalized.append(product)
+        
+        created = await self.db.create_products(normalized)
+        if created is None:
+            return {'error': 'Error creando productos en BD'}
+        
+        log.info("%s productos creados", len(created))
+        return {
+            'type': 'add_products',
+            'status': 'success',
+            'data': created
+        }
+    
     async def handle_notify(self, ws, data: dict) -> dict:
         """Notifica a un canal"""
         channel = data.get('channel')
@@ -119,52 +444,74 @@ class MessageHandler:
         if not channel or payload is None:
             return {'error': 'Falta "channel" o "payload"'}
         
-        await self._broadcast_to_channel(
-            channel,
-            {'type': 'notification', 'channel': channel, 'data': payload},
-            exclude_client=ws
-        )
+        message = {'type': 'notification', 'channel': channel, 'data': payload}
+        await self._broadcast_to_channel(channel, message, exclude_client=ws)
+        if self.bus is not None:
+            # Suscriptores conectados a otros workers (cada uno numera en su historial)
+            self.bus.publish('notify', {'channel': channel, 'message': message})
         
         return {'type': 'notify_ack', 'channel': channel}
     
+    async def on_bus_notify(self, data: dict) -> None:
+        """Notificación publicada en otro worker"""
+        channel = data.get('channel')
+        if channel and data.get('message') is not None:
+            await self._broadcast_to_channel(channel, data['message'])
+    
     async def _broadcast_to_channel(self, channel: str, message: dict, exclude_client=None) -> None:
-        """Envía mensaje a todos los suscriptores de un canal"""
+        """Numera el mensaje en el historial del canal y lo envía a sus suscriptores"""
+        message = self.history.record(channel, message)
         subscribers = self.connections.get_channel_subscribers(channel)
-        for client in subscribers:
-            if client != exclude_client:
-                await self._send_safe(client, message)
+        await self.broadcaster.broadcast(subscribers, message, exclude_client=exclude_client)
     
     
     async def handle_get_clients_count(self, ws, data: dict) -> dict:
-        """Devuelve el número de clientes conectados"""
-        client_count = self.connections.get_clients_count()
-        
-        # Enviar a todos los clientes el conteo actualizado
-        message = {
-            'type': 'clients_count',
-            'data': {
-                'count': client_count,
-                'clientsOnline': client_count,
-                'timestamp': str(asyncio.get_event_loop().time())
-            }
-        }
+        """Devuelve el número de clientes conectados (solo a quien lo pide)"""
+        return self.presence.current_message()
+    
+    async def handle_hello(self, ws, data: dict) -> dict:
+        """
+        Negocia opciones de la conexión: `codec` (json, msgpack, cbor si están
+        instalados) y `batching`. La respuesta ya va en el codec elegido; los
+        codecs binarios usan frames binarios, así que el cliente distingue
+        ambos formatos por el tipo de frame.
+        """
+        name = data.get('codec')
+        if name is not None:
+            codec = wire.get_codec(name)
+            if codec is None:
+                return {'error': f'Codec no disponible: {name}', 'codecs': list(wire.CODECS)}
+            self.broadcaster.set_codec(ws, codec)
         
-        # Broadcast a todos
-        await self._broadcast_to_all(message)
+        if 'batching' in data:
+            response = await self.handle_batching(ws, {'enabled': data['batching']})
+            if 'error' in response:
+                return response
         
-        return message
+        state = self.connections.get_state(ws)
+        outbound = state.outbound if state is not None else None
+        return {
+            'type': 'hello',
+            'codec': state.codec.name if state is not None else wire.JSON.name,
+            'codecs': list(wire.CODECS),
+            'batching': outbound is not None and outbound.batch_window > 0,
+            'compression': [extension.name for extension in getattr(ws, 'extensions', [])]
+        }
     
-    async def _broadcast_to_all(self, message: dict) -> None:
-        """Envía mensaje a todos los clientes conectados"""
-        for client in self.connections.get_all_clients():
-            await self._send_safe(client, message)
-
-    @staticmethod
-    async def _send_safe(ws, message: dict) -> bool:
-        """Envía mensaje de forma segura"""
-        try:
-            await ws.send(json.dumps(message))
-            return True
-        except Exception as e:
-            print(f"Error enviando mensaje: {e}")
-            return False
+    async def handle_batching(self, ws, data: dict) -> dict:
+        """Opt-in: agrupar los mensajes de una ráfaga en un solo frame `batch`"""
+        enabled = data.get('enabled', True)
+        if not isinstance(enabled, bool):
+            return {'error': '"enabled" debe ser booleano'}
+        if not self.broadcaster.set_batching(ws, enabled):
+            return {'error': 'Batching no disponible (cola de salida desactivada)'}
+        return {
+            'type': 'batching',
+            'enabled': enabled,
+            'window_ms': self.broadcaster.batch_window * 1000,
+            'max_size': self.broadcaster.batch_max_size
+        }
+    
+    async def _send_safe(self, ws, message: Union[Frame, dict]) -> bool:
+        """Envía mensaje de forma segura (espera espacio en la cola de salida)"""
+        return await self.broadcaster.send(ws, message, wait=True)
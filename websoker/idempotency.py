@@ -0,0 +1,43 @@
+"""Caché acotada (TTL + LRU) de claves de idempotencia"""
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+
+class IdempotencyCache:
+    """
+    Recuerda el resultado de operaciones por `idempotency_key` durante `ttl`
+    segundos, con como máximo `max_size` entradas (se descarta la menos usada).
+    """
+    
+    def __init__(self, max_size: Optional[int] = None, ttl: Optional[float] = None):
+        self.max_size = max_size or int(os.getenv('IDEMPOTENCY_CACHE_SIZE', '10000'))
+        self.ttl = ttl if ttl is not None else float(os.getenv('IDEMPOTENCY_TTL', '600'))
+        self.hits = 0
+        self._entries: OrderedDict = OrderedDict()  # clave -> (expira, valor)
+    
+    def get(self, key: str) -> Optional[Any]:
+        """Valor vigente para la clave, o None"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if time.monotonic() >= expires_at:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+    
+    def put(self, key: str, value: Any) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+    
+    def discard(self, key: str) -> None:
+        self._entries.pop(key, None)
+    
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,196 @@
+"""
+Logging estructurado fuera del event loop.
+Los módulos registran con `get_logger(__name__)` y argumentos diferidos
+(`log.info("... %s", valor)`): en el hilo que llama solo se filtra y se
+encola el registro; el formateo y la escritura a stdout ocurren en un hilo
+aparte. Niveles con LOG_LEVEL, formato texto o JSON con LOG_FORMAT.
+
+- Muestreo: los eventos de alto volumen se registran con `extra=SAMPLED` y
+  solo se escribe 1 de cada LOG_SAMPLE_EVERY por mensaje.
+- Límite de errores repetidos: WARNING o más, como máximo LOG_RATE_LIMIT
+  por mensaje cada LOG_RATE_WINDOW segundos; el siguiente que pase indica
+  cuántos se suprimieron.
+"""
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import logging
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+
+
+ROOT = 'websoker'
+
+# extra= de los eventos muestreados (constante: no asigna nada por llamada)
+SAMPLED = {'sampled': True}
+
+# Atributos propios de LogRecord; el resto viene de `extra` y va como campo
+_RECORD_FIELDS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Logger hijo de `websoker` (hereda nivel y handler de setup_logging)"""
+    return logging.getLogger(f'{ROOT}.{name}')
+
+
+class SamplingFilter(logging.Filter):
+    """Deja pasar 1 de cada `every` registros marcados con SAMPLED, por mensaje"""
+    
+    def __init__(self, every: int):
+        super().__init__()
+        self.every = every
+        self._counts: Dict[str, int] = {}
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.every <= 1 or not getattr(record, 'sampled', False):
+            return True
+        seen = self._counts.get(record.msg, 0)
+        self._counts[record.msg] = seen + 1
+        if seen % self.every:
+            return False
+        record.sample_rate = self.every
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """Limita WARNING o más a `limit` registros por mensaje y ventana"""
+    
+    # Mensajes distintos seguidos; al superarlo se reinicia el estado
+    MAX_KEYS = 1000
+    
+    def __init__(self, limit: int, window: float):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self._windows: Dict[tuple, list] = {}  # (logger, mensaje) -> [inicio, emitidos, suprimidos]
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING or self.limit <= 0:
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        state = self._windows.get(key)
+        if state is None or now - state[0] >= self.window:
+            if state is not None and state[2]:
+                record.suppressed = state[2]
+            if len(self._windows) >= self.MAX_KEYS:
+                self._windows.clear()
+            self._windows[key] = [now, 1, 0]
+            return True
+        if state[1] < self.limit:
+            state[1] += 1
+            return True
+        state[2] += 1
+        return False
+
+
+class TextFormatter(logging.Formatter):
+    """Una línea legible: hora, nivel y mensaje (más los avisos de muestreo/supresión)"""
+    
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)-7s %(message)s')
+    
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        if getattr(record, 'suppressed', 0):
+            line += f' (+{record.suppressed} repetidos suprimidos)'
+        if getattr(record, 'sample_rate', 0):
+            line += f' (muestreo 1/{record.sample_rate})'
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    """Un objeto JSON por línea; `event` es la plantilla del mensaje, estable para agrupar"""
+    
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'event': record.msg if isinstance(record.msg, str) else str(record.msg),
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS and key != 'sampled':
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Encola el registro tal cual, sin formatearlo (eso lo hace el hilo del
+    listener). Con la cola llena el registro se descarta: nunca bloquea.
+    Los argumentos se formatean más tarde, así que deben ser inmutables.
+    """
+    
+    def __init__(self, maxsize: int):
+        # SimpleQueue (en C, sin locks de Python); el tope se controla aquí
+        super().__init__(queue.SimpleQueue())
+        self.maxsize = maxsize
+        self.dropped = 0
+    
+    def handle(self, record: logging.LogRecord) -> bool:
+        # Sin el lock del handler: encolar ya es seguro entre hilos
+        if not self.filter(record):
+            return False
+        self.enqueue(record)
+        return True
+    
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if self.queue.qsize() >= self.maxsize:
+            self.dropped += 1
+            return
+        self.queue.put_nowait(record)
+
+
+_handler: Optional[NonBlockingQueueHandler] = None
+_listener: Optional[QueueListener] = None
+
+
+def setup_logging() -> None:
+    """Configura el logger `websoker` y arranca el hilo escritor (idempotente)"""
+    global _handler, _listener
+    if _listener is not None:
+        return
+    
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter() if os.getenv('LOG_FORMAT', 'text').lower() == 'json' else TextFormatter())
+    
+    # Ningún formato usa archivo/línea, hilo ni proceso: no se capturan al crear el registro
+    logging._srcfile = None
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+    
+    _handler = NonBlockingQueueHandler(int(os.getenv('LOG_QUEUE_SIZE', '10000')))
+    _handler.addFilter(SamplingFilter(int(os.getenv('LOG_SAMPLE_EVERY', '1'))))
+    _handler.addFilter(RateLimitFilter(int(os.getenv('LOG_RATE_LIMIT', '10')), float(os.getenv('LOG_RATE_WINDOW', '60'))))
+    
+    root = logging.getLogger(ROOT)
+    root.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+    root.addHandler(_handler)
+    root.propagate = False
+    
+    _listener = QueueListener(_handler.queue, output)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging() -> None:
+    """Escribe lo pendiente y detiene el hilo escritor"""
+    global _listener
+    if _listener is None:
+        return
+    logging.getLogger(ROOT).removeHandler(_handler)
+    _listener.stop()
+    _listener = None
+
+
+def dropped_count() -> int:
+    """Registros descartados por cola llena desde el inicio"""
+    return _handler.dropped if _handler is not None else 0
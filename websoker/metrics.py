@@ -0,0 +1,243 @@
+"""
+Métricas del servidor en formato de texto de Prometheus, servidas por HTTP
+en un puerto aparte (METRICS_PORT). Sin dependencias: contadores, gauges e
+histogramas en memoria del event loop, pensados para quedar siempre activos
+(registrar una observación es un par de operaciones de diccionario).
+"""
+import os
+import asyncio
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from logs import get_logger
+
+
+log = get_logger(__name__)
+
+
+# Segundos: de 0.5 ms (handlers en memoria) a 5 s (consultas lentas)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _format_labels(names: Sequence[str], values: Tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Contador monótono, opcionalmente con etiquetas; con `function` lee un total acumulado ajeno"""
+    kind = 'counter'
+    
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.function: Optional[Callable[[], float]] = None
+        self._values: Dict[Tuple, float] = {}
+    
+    def inc(self, *label_values, amount: float = 1) -> None:
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+    
+    def set_function(self, function: Callable[[], float]) -> None:
+        self.function = function
+    
+    def render(self) -> List[str]:
+        if self.function is not None:
+            try:
+                return [f'{self.name} {_format_value(self.function())}']
+            except Exception:
+                return []
+        return [f'{self.name}{_format_labels(self.labels, key)} {_format_value(value)}'
+                for key, value in self._values.items()]
+
+
+class Gauge:
+    """Valor instantáneo; con `function` se calcula al momento de exportar"""
+    kind = 'gauge'
+    
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (),
+                 function: Optional[Callable[[], float]] = None):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.function = function
+        self._values: Dict[Tuple, float] = {}
+    
+    def set(self, value: float, *label_values) -> None:
+        self._values[label_values] = value
+    
+    def set_function(self, function: Callable[[], float]) -> None:
+        self.function = function
+    
+    def render(self) -> List[str]:
+        if self.function is not None:
+            try:
+                return [f'{self.name} {_format_value(self.function())}']
+            except Exception:
+                return []
+        return [f'{self.name}{_format_labels(self.labels, key)} {_format_value(value)}'
+                for key, value in self._values.items()]
+
+
+class Histogram:
+    """Histograma de buckets fijos; cada observación es una búsqueda binaria"""
+    kind = 'histogram'
+    
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # etiquetas -> [conteo por bucket (+Inf al final), suma]
+        self._series: Dict[Tuple, list] = {}
+    
+    def observe(self, value: float, *label_values) -> None:
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+    
+    def render(self) -> List[str]:
+        lines = []
+        for key, (counts, total) in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                labels = _format_labels(self.labels, key, f'le="{_format_value(bound)}"')
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labels, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class Registry:
+    """Conjunto de métricas exportadas por el endpoint"""
+    
+    def __init__(self):
+        self.metrics: list = []
+    
+    def counter(self, name: str, help_text: str, labels: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help_text, labels))
+    
+    def gauge(self, name: str, help_text: str, labels: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, help_text, labels))
+    
+    def histogram(self, name: str, help_text: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, labels, buckets))
+    
+    def _register(self, metric):
+        self.metrics.append(metric)
+        return metric
+    
+    def render(self) -> str:
+        """Texto en el formato de exposición de Prometheus (0.0.4)"""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+CONNECTIONS = REGISTRY.gauge('websoker_connections', 'Conexiones WebSocket abiertas en este proceso')
+MESSAGES = REGISTRY.counter('websoker_messages_total', 'Mensajes recibidos por acción', ('action',))
+HANDLER_SECONDS = REGISTRY.histogram('websoker_handler_seconds', 'Duración de los handlers por acción', ('action',))
+BROADCAST_SECONDS = REGISTRY.histogram('websoker_broadcast_seconds', 'Duración del fan-out de un broadcast')
+BROADCAST_RECIPIENTS = REGISTRY.counter('websoker_broadcast_recipients_total', 'Destinatarios alcanzados por broadcasts')
+SEND_FAILURES = REGISTRY.counter('websoker_send_failures_total', 'Envíos fallidos por motivo', ('reason',))
+CLIENT_RTT_SECONDS = REGISTRY.histogram('websoker_client_rtt_seconds', 'RTT de los clientes medido por el heartbeat')
+OUTBOUND_DROPPED = REGISTRY.counter('websoker_outbound_dropped_total', 'Frames descartados o reemplazados en colas de salida')
+DB_QUERY_SECONDS = REGISTRY.histogram('websoker_db_query_seconds', 'Duración de operaciones de BD (incluye espera del pool)', ('query',))
+LOG_DROPPED = REGISTRY.counter('websoker_log_dropped_total', 'Registros de log descartados por cola llena')
+LOOP_LAG = REGISTRY.gauge('websoker_event_loop_lag_seconds', 'Retraso del event loop en la última medición')
+# El gauge solo guarda la última muestra: los picos entre scrapes quedan aquí
+LOOP_LAG_SAMPLES = REGISTRY.histogram('websoker_event_loop_lag_samples_seconds', 'Muestras del retraso del event loop')
+
+
+async def lag_monitor(interval: float) -> None:
+    """Mide cuánto tarda el loop en despertar una tarea respecto a lo pedido"""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - start - interval)
+        LOOP_LAG.set(lag)
+        LOOP_LAG_SAMPLES.observe(lag)
+
+
+class MetricsServer:
+    """Endpoint HTTP mínimo: GET /metrics en METRICS_HOST:METRICS_PORT"""
+    
+    def __init__(self, registry: Registry = REGISTRY, host: Optional[str] = None, port: Optional[int] = None):
+        self.registry = registry
+        self.host = host or os.getenv('METRICS_HOST', 'localhost')
+        self.port = port if port is not None else int(os.getenv('METRICS_PORT', '9101'))
+        self.enabled = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+        self.lag_interval = float(os.getenv('METRICS_LAG_INTERVAL', '0.5'))
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._lag_task: Optional[asyncio.Task] = None
+    
+    async def start(self) -> bool:
+        if not self.enabled:
+            return False
+        try:
+            self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        except OSError as e:
+            log.warning("⚠️ No se pudo abrir el endpoint de métricas en %s:%s: %s", self.host, self.port, e)
+            return False
+        self._lag_task = asyncio.create_task(lag_monitor(self.lag_interval))
+        return True
+    
+    async def close(self) -> None:
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+    
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request = await asyncio.wait_for(reader.readline(), timeout=5)
+            # Descartar los headers
+            while True:
+                line = await asyncio.wait_for(reader.readline(), timeout=5)
+                if not line or line in (b'\r\n', b'\n'):
+                    break
+            
+            parts = request.decode('latin-1').split()
+            path = parts[1].split('?', 1)[0] if len(parts) > 1 else ''
+            if parts and parts[0] == 'GET' and path in ('/metrics', '/'):
+                status = '200 OK'
+                body = self.registry.render().encode()
+            else:
+                status = '404 Not Found'
+                body = b'not found\n'
+            writer.write(
+                f'HTTP/1.1 {status}\r\n'
+                f'Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+                f'Content-Length: {len(body)}\r\n'
+                f'Connection: close\r\n\r\n'.encode() + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
@@ -1,8 +1,14 @@
 """Modelos de datos para WebSocket"""
+import json
+import time
 from dataclasses import dataclass
-from typing import Dict, Any, Set, Optional
+from typing import Dict, Any, List, Set, Optional, Tuple, Union
 from datetime import datetime
 
+import wire
+from subscriptions import PatternIndex
+from product_filters import ProductFilterIndex
+
 
 @dataclass
 class Message:
@@ -22,6 +28,49 @@ class Message:
         )
 
 
+class Frame:
+    """
+    Mensaje serializado una sola vez y reutilizado para cada destinatario.
+    `data` es el JSON; otros codecs se codifican bajo demanda y se cachean.
+    """
+    __slots__ = ('message', 'data', '_encoded')
+    
+    def __init__(self, message: Dict[str, Any]):
+        self.message = message
+        self.data = wire.dumps(message)
+        self._encoded: Optional[Dict[str, Union[str, bytes]]] = None
+    
+    @classmethod
+    def wrap(cls, message: Union['Frame', Dict[str, Any]]) -> 'Frame':
+        """Retorna el frame tal cual o codifica el diccionario"""
+        if isinstance(message, cls):
+            return message
+        return cls(message)
+    
+    def with_fields(self, **fields) -> 'Frame':
+        """Copia con campos extra al inicio, sin volver a codificar el mensaje completo"""
+        if not fields:
+            return self
+        if not isinstance(self.message, dict) or not self.message or fields.keys() & self.message.keys():
+            return Frame({**self.message, **fields})
+        frame = Frame.__new__(Frame)
+        frame.message = {**fields, **self.message}
+        frame.data = '{' + json.dumps(fields)[1:-1] + ', ' + self.data[1:]
+        frame._encoded = None
+        return frame
+    
+    def encode(self, codec) -> Union[str, bytes]:
+        """Payload para el codec de la conexión (una vez por codec)"""
+        if codec is wire.JSON:
+            return self.data
+        if self._encoded is None:
+            self._encoded = {}
+        payload = self._encoded.get(codec.name)
+        if payload is None:
+            payload = self._encoded[codec.name] = codec.encode(self.message)
+        return payload
+
+
 @dataclass
 class Stats:
     """Estadísticas del servidor"""
@@ -38,69 +87,155 @@ class Stats:
         }
 
 
+class ClientState:
+    """Estado compacto de una conexión"""
+    __slots__ = ('ip', 'channels', 'connected_at', 'last_activity',
+                 'messages_in', 'messages_out', 'rtt', 'outbound', 'codec')
+    
+    def __init__(self, ip: str):
+        now = time.monotonic()
+        self.ip = ip
+        self.channels: Set[str] = set()
+        self.connected_at = now
+        self.last_activity = now
+        self.messages_in = 0
+        self.messages_out = 0
+        self.rtt: Optional[float] = None
+        self.outbound = None  # OutboundQueue, si el broadcaster la adjuntó
+        self.codec = wire.JSON  # codec negociado (subprotocolo o hello)
+
+
 class ConnectionManager:
     """Gestor de conexiones y canales"""
     
     def __init__(self):
-        self.clients: Set = set()
-        self.subscriptions: Dict[str, Set] = {}
-        self.client_channels: Dict = {}
-        self.client_ips: Dict = {}  # websocket -> IP mapping
-        self.unique_ips: Set[str] = set()  # IPs únicas conectadas
+        self.clients: Dict[Any, ClientState] = {}  # websocket -> estado
+        self.subscriptions: Dict[str, Set] = {}  # canal -> websockets
+        self.patterns = PatternIndex()  # suscripciones con comodines (categoria.*)
+        self.product_filters = ProductFilterIndex()  # subscribe_products
+        self.ip_counts: Dict[str, int] = {}  # IP -> conexiones abiertas
     
     def add_client(self, ws) -> None:
         """Agrega un cliente conectado"""
-        self.clients.add(ws)
-        self.client_channels[ws] = set()
+        if ws in self.clients:
+            return
         
         # Rastrear IP única
         try:
             ip = ws.remote_address[0] if ws.remote_address else 'unknown'
-            self.client_ips[ws] = ip
-            self.unique_ips.add(ip)
         except Exception:
-            self.client_ips[ws] = 'unknown'
-            self.unique_ips.add('unknown')
+            ip = 'unknown'
+        self.clients[ws] = ClientState(ip)
+        self.ip_counts[ip] = self.ip_counts.get(ip, 0) + 1
     
     def remove_client(self, ws) -> None:
         """Remueve un cliente y sus suscripciones"""
-        if ws in self.clients:
-            self.clients.remove(ws)
+        state = self.clients.pop(ws, None)
+        if state is None:
+            return
+        if state.outbound is not None:
+            state.outbound.close()
         
-        # Limpiar IP tracking
-        client_ip = self.client_ips.pop(ws, None)
-        if client_ip:
-            # Solo remover IP si no hay otras conexiones de la misma IP
-            ip_still_connected = any(
-                ip == client_ip for ip in self.client_ips.values()
-            )
-            if not ip_still_connected:
-                self.unique_ips.discard(client_ip)
+        # Solo remover IP si no hay otras conexiones de la misma IP
+        remaining = self.ip_counts.get(state.ip, 0) - 1
+        if remaining > 0:
+            self.ip_counts[state.ip] = remaining
+        else:
+            self.ip_counts.pop(state.ip, None)
         
         # Limpiar suscripciones
-        channels = self.client_channels.pop(ws, set())
-        for channel in channels:
-            if channel in self.subscriptions and ws in self.subscriptions[channel]:
-                self.subscriptions[channel].remove(ws)
-            
-            if not self.subscriptions[channel]:
-                del self.subscriptions[channel]
+        for channel in state.channels:
+            self._discard_subscription(ws, channel)
+        self.product_filters.discard(ws)
+    
+    def get_state(self, ws) -> Optional[ClientState]:
+        """Estado de la conexión, o None si ya no está registrada"""
+        return self.clients.get(ws)
+    
+    def touch(self, ws) -> None:
+        """Registra tráfico entrante del cliente (prueba de vida para el heartbeat)"""
+        state = self.clients.get(ws)
+        if state is not None:
+            state.last_activity = time.monotonic()
+            state.messages_in += 1
+    
+    def record_sent(self, ws) -> None:
+        """Cuenta un mensaje enviado al cliente"""
+        state = self.clients.get(ws)
+        if state is not None:
+            state.messages_out += 1
+    
+    def get_idle_clients(self, idle_for: float) -> list:
+        """Clientes sin tráfico entrante durante al menos `idle_for` segundos"""
+        now = time.monotonic()
+        return [ws for ws, state in self.clients.items() if now - state.last_activity >= idle_for]
+    
+    def record_rtt(self, ws, rtt: float) -> None:
+        """Guarda el RTT medido por el heartbeat"""
+        state = self.clients.get(ws)
+        if state is not None:
+            state.rtt = rtt
     
     def subscribe(self, ws, channel: str) -> None:
         """Suscribe un cliente a un canal"""
-        self.subscriptions.setdefault(channel, set()).add(ws)
-        self.client_channels.setdefault(ws, set()).add(channel)
+        state = self.clients.get(ws)
+        if state is None:
+            return
+        if PatternIndex.is_pattern(channel):
+            self.patterns.add(channel, ws)
+        else:
+            self.subscriptions.setdefault(channel, set()).add(ws)
+        state.channels.add(channel)
     
     def unsubscribe(self, ws, channel: str) -> None:
         """Desuscribe un cliente de un canal"""
-        if channel in self.subscriptions and ws in self.subscriptions[channel]:
-            self.subscriptions[channel].remove(ws)
+        state = self.clients.get(ws)
+        if state is not None:
+            state.channels.discard(channel)
+        self._discard_subscription(ws, channel)
+    
+    def _discard_subscription(self, ws, channel: str) -> None:
+        if PatternIndex.is_pattern(channel):
+            self.patterns.remove(channel, ws)
+            return
+        subscribers = self.subscriptions.get(channel)
+        if subscribers is not None:
+            subscribers.discard(ws)
+            if not subscribers:
+                del self.subscriptions[channel]
+    
+    def set_product_filter(self, ws, filters: dict) -> None:
+        """Filtros de productos del cliente; sin filtros recibe todos (por defecto)"""
+        if ws not in self.clients:
+            return
+        if filters:
+            self.product_filters.set(ws, filters)
+        else:
+            self.product_filters.discard(ws)
+    
+    def group_product_recipients(self, products: List[dict]) -> List[Tuple[list, List[dict]]]:
+        """
+        Agrupa destinatarios según los productos que les interesan.
+        Retorna: [(clientes, productos)] con un grupo por subconjunto distinto
+        """
+        if not len(self.product_filters):
+            return [(list(self.clients), products)]
         
-        if ws in self.client_channels and channel in self.client_channels[ws]:
-            self.client_channels[ws].remove(channel)
+        matches: Dict[Any, List[int]] = {}
+        for i, product in enumerate(products):
+            for ws in self.product_filters.match(product):
+                matches.setdefault(ws, []).append(i)
         
-        if channel in self.subscriptions and not self.subscriptions[channel]:
-            del self.subscriptions[channel]
+        everything = tuple(range(len(products)))
+        groups: Dict[tuple, list] = {
+            everything: [ws for ws in self.clients if ws not in self.product_filters]
+        }
+        for ws, indexes in matches.items():
+            groups.setdefault(tuple(indexes), []).append(ws)
+        return [
+            (clients, products if indexes == everything else [products[i] for i in indexes])
+            for indexes, clients in groups.items() if clients
+        ]
     
     def get_clients(self) -> list:
         """Obtiene lista de clientes conectados"""
@@ -117,15 +252,27 @@ class ConnectionManager:
     
     def get_connection_info(self) -> dict:
         """Obtiene información detallada de conexiones para debug"""
+        rtts = [state.rtt for state in self.clients.values() if state.rtt is not None]
+        queues = [state.outbound for state in self.clients.values() if state.outbound is not None]
         return {
             'total_connections': len(self.clients),
-            'unique_ips': len(self.unique_ips),
-            'ips': list(self.unique_ips)
+            'unique_ips': len(self.ip_counts),
+            'ips': list(self.ip_counts),
+            'rtt_avg_ms': round(sum(rtts) / len(rtts) * 1000, 2) if rtts else None,
+            'rtt_max_ms': round(max(rtts) * 1000, 2) if rtts else None,
+            'outbound_depth': sum(len(q) for q in queues),
+            'outbound_max_depth': max((q.high_water for q in queues), default=0),
+            'outbound_dropped': sum(q.dropped for q in queues)
         }
     
     def get_channel_subscribers(self, channel: str) -> list:
-        """Obtiene suscriptores de un canal"""
-        return list(self.subscriptions.get(channel, set()))
+        """Obtiene suscriptores de un canal (exactos y por patrón)"""
+        subscribers = self.subscriptions.get(channel, set())
+        if not len(self.patterns):
+            return list(subscribers)
+        matched = self.patterns.match(channel)
+        matched |= subscribers
+        return list(matched)
     
     def get_stats(self) -> Stats:
         """Obtiene estadísticas del servidor"""
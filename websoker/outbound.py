@@ -0,0 +1,232 @@
+"""Colas de salida por conexión con backpressure"""
+import asyncio
+from collections import deque
+from typing import Callable, Dict, Optional
+
+import wire
+from models import Frame
+import metrics
+from logs import get_logger
+
+
+log = get_logger(__name__)
+
+
+DROP_OLDEST = 'drop_oldest'
+CONFLATE = 'conflate'
+DISCONNECT = 'disconnect'
+POLICIES = (DROP_OLDEST, CONFLATE, DISCONNECT)
+
+# Solo importa el último valor: siempre se reemplaza el que sigue en cola.
+# El resto (new_product, notification con seq, ...) son eventos distintos
+# aunque compartan `type`: nunca se reemplazan entre sí
+ALWAYS_CONFLATE = {'clients_count'}
+
+
+class OutboundQueue:
+    """
+    Cola acotada de frames para un cliente, drenada por su propia tarea.
+    Un cliente que deja de leer solo llena su cola; al desbordarse se aplica
+    la política configurada:
+    - drop_oldest: se descarta el frame más antiguo (predeterminada)
+    - conflate: igual que drop_oldest; se acepta por compatibilidad, ya que
+      los tipos de último valor (ALWAYS_CONFLATE) se reemplazan en cualquier política
+    - disconnect: se desconecta al consumidor lento
+    
+    Con batching activado (opt-in del cliente) la tarea espera `batch_window`
+    tras el primer frame y envía lo acumulado, hasta `batch_max_size` frames
+    y `batch_max_bytes`, en un único frame `batch` armado concatenando los
+    mensajes ya codificados con el codec de la conexión.
+    """
+    
+    def __init__(self, ws, maxsize: int, policy: str, send_timeout: float,
+                 on_dead: Callable, on_sent: Optional[Callable] = None):
+        if policy not in POLICIES:
+            raise ValueError(f"Politica de cola desconocida: {policy}")
+        self.ws = ws
+        self.maxsize = maxsize
+        self.policy = policy
+        self.send_timeout = send_timeout
+        self.on_dead = on_dead
+        self.on_sent = on_sent
+        
+        self.sent = 0
+        self.dropped = 0
+        self.high_water = 0
+        self.closed = False
+        
+        self.batch_window = 0.0
+        self.batch_max_size = 1
+        self.batch_max_bytes = 0
+        self.batches = 0
+        self.codec = wire.JSON
+        
+        self._queue: deque = deque()
+        self._ready = asyncio.Event()
+        self._space = asyncio.Event()
+        self._space.set()
+        # Frames cuyo productor espera a que se escriban (put_flush)
+        self._flushing: Dict[Frame, asyncio.Future] = {}
+        self._task = asyncio.ensure_future(self._run())
+    
+    def __len__(self) -> int:
+        return len(self._queue)
+    
+    def put(self, frame: Frame) -> bool:
+        """Encola sin bloquear aplicando la política de desborde. Retorna: False si se descartó"""
+        if self.closed:
+            return False
+        
+        msg_type = self._type_of(frame)
+        if msg_type in ALWAYS_CONFLATE and self._replace(msg_type, frame):
+            self.dropped += 1
+            metrics.OUTBOUND_DROPPED.inc()
+            return True
+        
+        if len(self._queue) >= self.maxsize:
+            self.dropped += 1
+            metrics.OUTBOUND_DROPPED.inc()
+            if self.policy == DISCONNECT:
+                metrics.SEND_FAILURES.inc('slow_consumer')
+                log.warning("🐢 Consumidor lento desconectado: %s", self.ws.remote_address)
+                self.on_dead(self.ws)
+                return False
+            self._settle(self._queue.popleft(), False)
+        
+        self._append(frame)
+        return True
+    
+    async def put_wait(self, frame: Frame, timeout: float) -> bool:
+        """Encola esperando espacio (sin descartar); para respuestas y streams"""
+        try:
+            while not self.closed and len(self._queue) >= self.maxsize:
+                await asyncio.wait_for(self._space.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            metrics.SEND_FAILURES.inc('queue_full')
+            log.warning("⏱️ Cola de salida llena para %s", self.ws.remote_address)
+            self.on_dead(self.ws)
+            return False
+        if self.closed:
+            return False
+        self._append(frame)
+        return True
+    
+    async def put_flush(self, frame: Frame, timeout: float) -> bool:
+        """
+        Como put_wait, pero retorna cuando el frame ya se escribió en el socket.
+        Los streams lo usan para no leer el siguiente bloque mientras el cliente
+        no recibe el anterior. Retorna: False si se descartó o la conexión cayó
+        """
+        done = asyncio.get_running_loop().create_future()
+        self._flushing[frame] = done
+        if not await self.put_wait(frame, timeout):
+            self._flushing.pop(frame, None)
+            return False
+        return await done
+    
+    def set_batching(self, window: float, max_size: int, max_bytes: int) -> None:
+        """Activa (window > 0) o desactiva el agrupado de frames"""
+        self.batch_window = window
+        self.batch_max_size = max(1, max_size)
+        self.batch_max_bytes = max_bytes
+    
+    def close(self) -> None:
+        """Detiene la tarea escritora y descarta lo pendiente"""
+        self.closed = True
+        for frame in self._queue:
+            self._settle(frame, False)
+        self._queue.clear()
+        self._space.set()
+        if self._task is not asyncio.current_task():
+            self._task.cancel()
+    
+    def _append(self, frame: Frame) -> None:
+        self._queue.append(frame)
+        depth = len(self._queue)
+        if depth > self.high_water:
+            self.high_water = depth
+        if depth >= self.maxsize:
+            self._space.clear()
+        self._ready.set()
+    
+    def _replace(self, msg_type: Optional[str], frame: Frame) -> bool:
+        if msg_type is None:
+            return False
+        for i in range(len(self._queue) - 1, -1, -1):
+            if self._type_of(self._queue[i]) == msg_type:
+                self._settle(self._queue[i], False)
+                self._queue[i] = frame
+                return True
+        return False
+    
+    def _settle(self, frame: Frame, sent: bool) -> None:
+        if self._flushing:
+            done = self._flushing.pop(frame, None)
+            if done is not None and not done.done():
+                done.set_result(sent)
+    
+    @staticmethod
+    def _type_of(frame: Frame) -> Optional[str]:
+        message = frame.message
+        return message.get('type') if isinstance(message, dict) else None
+    
+    async def _run(self) -> None:
+        while True:
+            while not self._queue:
+                self._ready.clear()
+                await self._ready.wait()
+            
+            if self.batch_window > 0 and len(self._queue) < self.batch_max_size:
+                # Dar tiempo a que llegue el resto de la ráfaga
+                await asyncio.sleep(self.batch_window)
+            
+            frames = self._take_batch()
+            if len(self._queue) < self.maxsize:
+                self._space.set()
+            codec = self.codec
+            if len(frames) == 1:
+                data = frames[0].encode(codec)
+            else:
+                data = codec.encode_batch([frame.encode(codec) for frame in frames])
+            
+            try:
+                await asyncio.wait_for(self.ws.send(data), timeout=self.send_timeout)
+            except asyncio.CancelledError:
+                for frame in frames:
+                    self._settle(frame, False)
+                raise
+            except asyncio.TimeoutError:
+                metrics.SEND_FAILURES.inc('timeout')
+                log.warning("⏱️ Timeout enviando mensaje a %s", self.ws.remote_address)
+                for frame in frames:
+                    self._settle(frame, False)
+                self.on_dead(self.ws)
+                return
+            except Exception as e:
+                metrics.SEND_FAILURES.inc('error')
+                log.warning("⚠️ Error enviando mensaje a %s: %s", self.ws.remote_address, e)
+                for frame in frames:
+                    self._settle(frame, False)
+                self.on_dead(self.ws)
+                return
+            
+            for frame in frames:
+                self._settle(frame, True)
+            self.sent += len(frames)
+            if len(frames) > 1:
+                self.batches += 1
+            if self.on_sent is not None:
+                for _ in frames:
+                    self.on_sent(self.ws)
+    
+    def _take_batch(self) -> list:
+        frames = [self._queue.popleft()]
+        if self.batch_window <= 0:
+            return frames
+        size = len(frames[0].data)
+        while self._queue and len(frames) < self.batch_max_size:
+            size += len(self._queue[0].data)
+            if size > self.batch_max_bytes:
+                break
+            frames.append(self._queue.popleft())
+        return frames
@@ -0,0 +1,206 @@
+"""Pool de conexiones PostgreSQL no bloqueante"""
+import os
+import time
+import queue
+import asyncio
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Optional
+
+import psycopg2
+
+from config import get_db_connection
+import metrics
+from logs import get_logger
+
+
+log = get_logger(__name__)
+
+
+# Errores que indican una conexión rota y justifican reconectar
+CONNECTION_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+
+class PoolError(Exception):
+    """No se pudo obtener una conexión válida"""
+
+
+class PoolSession:
+    """Conexión retenida durante varias operaciones (p. ej. un cursor con nombre)"""
+    
+    def __init__(self, pool: 'ConnectionPool', conn):
+        self.pool = pool
+        self.connection = conn
+    
+    async def run(self, fn: Callable, *args) -> Any:
+        """Ejecuta fn(conn, *args) en un hilo del pool sobre la conexión retenida"""
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        try:
+            return await loop.run_in_executor(self.pool._executor, fn, self.connection, *args)
+        finally:
+            metrics.DB_QUERY_SECONDS.observe(time.perf_counter() - start, fn.__name__.lstrip('_'))
+
+
+class ConnectionPool:
+    """
+    Conexiones psycopg2 atendidas por un executor de hilos acotado.
+    Consultas y sesiones comparten `size` cupos: cada una ocupa uno mientras
+    usa su conexión, y solo se abre una conexión nueva si no hay inactivas,
+    así que el pool nunca abre más de `size` (DB_POOL_SIZE) conexiones y las
+    consultas no bloquean el event loop.
+    """
+    
+    def __init__(self, factory: Optional[Callable] = None, size: Optional[int] = None,
+                 health_check_interval: Optional[float] = None, on_connect: Optional[Callable] = None):
+        self.factory = factory or get_db_connection
+        # Se ejecuta una vez por conexión nueva (p. ej. registrar typecasters)
+        self.on_connect = on_connect
+        self.size = size or int(os.getenv('DB_POOL_SIZE', '5'))
+        self.health_check_interval = (
+            health_check_interval if health_check_interval is not None
+            else float(os.getenv('DB_HEALTH_CHECK_INTERVAL', '30'))
+        )
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        # Un cupo por conexión en uso, tomado en el event loop antes de pasar al executor
+        self._slots = asyncio.Semaphore(self.size)
+        # Las sesiones retienen su cupo entre operaciones: a lo sumo la mitad,
+        # para que las consultas sueltas siempre tengan cupo
+        self._sessions = asyncio.Semaphore(max(1, self.size // 2))
+    
+    async def open(self) -> bool:
+        """Crea el executor y verifica que la BD responde"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix='db')
+        try:
+            return await self.run(self._ping)
+        except Exception as e:
+            log.error("Error abriendo pool de BD: %s", e)
+            return False
+    
+    async def run(self, fn: Callable, *args, retry: bool = True) -> Any:
+        """
+        Ejecuta fn(conn, *args) en un hilo del pool.
+        Con retry=True, si la conexión se cae se reintenta una vez con una nueva
+        (usar solo para operaciones idempotentes).
+        """
+        if self._executor is None:
+            raise PoolError('Pool no inicializado')
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        try:
+            async with self._slots:
+                return await loop.run_in_executor(self._executor, self._run, fn, args, retry)
+        finally:
+            metrics.DB_QUERY_SECONDS.observe(time.perf_counter() - start, fn.__name__.lstrip('_'))
+    
+    @asynccontextmanager
+    async def session(self) -> AsyncIterator[PoolSession]:
+        """Retiene una conexión hasta salir del bloque; luego se devuelve con rollback"""
+        if self._executor is None:
+            raise PoolError('Pool no inicializado')
+        loop = asyncio.get_running_loop()
+        async with self._sessions, self._slots:
+            conn = await loop.run_in_executor(self._executor, self._checkout)
+            broken = False
+            try:
+                yield PoolSession(self, conn)
+            except CONNECTION_ERRORS:
+                broken = True
+                raise
+            finally:
+                if broken:
+                    self._discard(conn)
+                else:
+                    await loop.run_in_executor(self._executor, self._release, conn, True)
+    
+    async def close(self) -> None:
+        """Cierra el executor y todas las conexiones inactivas"""
+        if self._executor is not None:
+            executor, self._executor = self._executor, None
+            # Esperar las consultas en curso sin bloquear el event loop
+            await asyncio.get_running_loop().run_in_executor(None, executor.shutdown, True)
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+    
+    # ---- Métodos ejecutados dentro de los hilos del pool ----
+    
+    def _run(self, fn: Callable, args: tuple, retry: bool) -> Any:
+        attempts = 2 if retry else 1
+        for attempt in range(attempts):
+            conn = self._checkout()
+            try:
+                result = fn(conn, *args)
+            except CONNECTION_ERRORS:
+                self._discard(conn)
+                if attempt + 1 == attempts:
+                    raise
+                log.warning("Conexion a BD perdida, reintentando con una nueva")
+                continue
+            except Exception:
+                self._release(conn, rollback=True)
+                raise
+            self._release(conn)
+            return result
+    
+    def _checkout(self):
+        """Toma una conexión inactiva sana o abre una nueva"""
+        while True:
+            try:
+                conn, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            if conn.closed:
+                continue
+            if time.monotonic() - last_used < self.health_check_interval:
+                return conn
+            try:
+                self._ping(conn)
+                return conn
+            except Exception:
+                self._discard(conn)
+        
+        conn = self.factory()
+        if conn is None:
+            raise PoolError('No se pudo abrir conexion a PostgreSQL')
+        if self.on_connect is not None:
+            try:
+                self.on_connect(conn)
+            except Exception:
+                self._discard(conn)
+                raise
+        return conn
+    
+    def _release(self, conn, rollback: bool = False) -> None:
+        if conn.closed:
+            return
+        if rollback:
+            try:
+                conn.rollback()
+            except Exception:
+                self._discard(conn)
+                return
+        self._idle.put((conn, time.monotonic()))
+    
+    @staticmethod
+    def _discard(conn) -> None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+    
+    @staticmethod
+    def _ping(conn) -> bool:
+        cur = conn.cursor()
+        try:
+            cur.execute('SELECT 1')
+            cur.fetchone()
+        finally:
+            cur.close()
+        conn.rollback()
+        return True
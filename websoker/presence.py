@@ -0,0 +1,117 @@
+"""Publicación de presencia (clients_count) agrupada y solo con cambios"""
+import os
+import time
+import asyncio
+import logging
+from typing import Dict, Optional, Tuple
+
+from models import Frame
+from logs import get_logger, SAMPLED
+
+
+log = get_logger(__name__)
+
+
+class PresencePublisher:
+    """
+    Combina los disparadores de presencia (conexiones, desconexiones y el
+    tick periódico) en como máximo un broadcast por ventana, y solo cuando
+    el conteo cambió respecto al último publicado.
+    
+    Con varios workers, cada uno anuncia su conteo local por el bus y el
+    total publicado suma los de los demás (los que dejan de anunciarse
+    caducan tras `remote_ttl`).
+    """
+    
+    def __init__(self, connections, broadcaster, window: Optional[float] = None,
+                 bus=None, remote_ttl: Optional[float] = None):
+        self.connections = connections
+        self.broadcaster = broadcaster
+        self.window = window if window is not None else float(os.getenv('PRESENCE_WINDOW', '1'))
+        self.bus = bus
+        self.remote_ttl = remote_ttl if remote_ttl is not None else float(os.getenv('PRESENCE_REMOTE_TTL', '10'))
+        self.remote_counts: Dict[int, Tuple[int, float]] = {}  # worker -> (conteo, recibido)
+        self.published_count: Optional[int] = None
+        self._published_at = 0.0
+        self._announced: Optional[int] = None
+        self._pending: Optional[asyncio.Task] = None
+    
+    @staticmethod
+    def build_message(count: int) -> dict:
+        """Mensaje clients_count con el formato que espera el frontend"""
+        return {
+            'type': 'clients_count',
+            'data': {
+                'count': count,
+                'clientsOnline': count,
+                'timestamp': str(asyncio.get_event_loop().time())
+            }
+        }
+    
+    def total_count(self) -> int:
+        """Conteo local más el de los demás workers vivos"""
+        local = len(self.connections.clients)
+        if not self.remote_counts:
+            return self.connections.get_clients_count()
+        now = time.monotonic()
+        for worker, (count, seen) in list(self.remote_counts.items()):
+            if now - seen > self.remote_ttl:
+                del self.remote_counts[worker]
+            else:
+                local += count
+        return max(1, local)
+    
+    def current_message(self) -> dict:
+        """Conteo actual para responder a un solo cliente"""
+        return self.build_message(self.total_count())
+    
+    def announce(self) -> None:
+        """Anuncia el conteo local a los demás workers (también sirve de latido)"""
+        if self.bus is not None:
+            self.bus.publish('presence', {'worker': self.bus.worker_id, 'count': len(self.connections.clients)})
+    
+    async def on_bus_presence(self, data: dict) -> None:
+        """Conteo anunciado por otro worker"""
+        worker = data.get('worker')
+        count = data.get('count')
+        if worker is None or not isinstance(count, int):
+            return
+        previous = self.remote_counts.get(worker)
+        self.remote_counts[worker] = (count, time.monotonic())
+        if previous is None or previous[0] != count:
+            self.mark_dirty()
+    
+    def mark_dirty(self) -> None:
+        """Solicita una publicación; se agrupa con las demás dentro de la ventana"""
+        if self._pending is not None and not self._pending.done():
+            return
+        delay = max(0.0, self._published_at + self.window - time.monotonic())
+        self._pending = asyncio.ensure_future(self._publish_after(delay))
+    
+    async def _publish_after(self, delay: float) -> None:
+        if delay:
+            await asyncio.sleep(delay)
+        try:
+            await self.publish()
+        except Exception as e:
+            log.warning("⚠️ Error broadcast presencia: %s", e)
+    
+    async def publish(self) -> bool:
+        """Difunde el conteo si cambió. Retorna: True si se envió"""
+        local = len(self.connections.clients)
+        if self.bus is not None and local != self._announced:
+            self._announced = local
+            self.announce()
+        
+        count = self.total_count()
+        if count == self.published_count:
+            return False
+        
+        self.published_count = count
+        self._published_at = time.monotonic()
+        await self.broadcaster.broadcast(self.connections.get_clients(), Frame(self.build_message(count)))
+        
+        if log.isEnabledFor(logging.INFO):
+            connection_info = self.connections.get_connection_info()
+            log.info("📊 Pestañas abiertas: %s (IPs únicas: %s)", count, connection_info['unique_ips'], extra=SAMPLED)
+        return True
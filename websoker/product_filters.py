@@ -0,0 +1,112 @@
+"""Suscripciones a productos filtradas por categoría, emprendedor y precio"""
+from typing import Any, Dict, Optional, Set, Tuple
+
+
+# (nombre en el mensaje, columna del producto)
+INDEXED_FIELDS = (
+    ('categoria', 'categoriaIdCategoria'),
+    ('emprendedor', 'emprendedorIdEmprendedor'),
+)
+
+
+class ProductFilterIndex:
+    """
+    Índices invertidos valor -> suscriptores por cada campo filtrable. Un
+    producto nuevo solo se compara con los suscriptores de su categoría y
+    emprendedor (más los que no filtran por ese campo), no con todos.
+    """
+    
+    def __init__(self):
+        self.filters: Dict[Any, dict] = {}  # websocket -> filtros normalizados
+        self._by_value: Dict[str, Dict[Any, Set]] = {field: {} for _, field in INDEXED_FIELDS}
+        self._unfiltered: Dict[str, Set] = {field: set() for _, field in INDEXED_FIELDS}
+        self._price: Dict[Any, Tuple[Optional[float], Optional[float]]] = {}
+    
+    @staticmethod
+    def parse(data: dict) -> Tuple[Optional[dict], Optional[str]]:
+        """Valida los filtros de `subscribe_products`. Retorna: (filtros, error)"""
+        filters = {}
+        for name, field in INDEXED_FIELDS:
+            value = data.get(name, data.get(field))
+            if value is None:
+                continue
+            values = value if isinstance(value, list) else [value]
+            if not values or any(isinstance(v, bool) or not isinstance(v, int) for v in values):
+                return None, f'"{name}" debe ser un entero o una lista de enteros'
+            filters[field] = sorted(set(values))
+        
+        for name in ('precio_min', 'precio_max'):
+            value = data.get(name)
+            if value is None:
+                continue
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                return None, f'"{name}" debe ser numérico'
+            filters[name] = value
+        
+        if filters.get('precio_min', float('-inf')) > filters.get('precio_max', float('inf')):
+            return None, '"precio_min" no puede ser mayor que "precio_max"'
+        return filters, None
+    
+    def set(self, subscriber, filters: dict) -> None:
+        """Reemplaza los filtros del suscriptor"""
+        self.discard(subscriber)
+        self.filters[subscriber] = filters
+        for _, field in INDEXED_FIELDS:
+            values = filters.get(field)
+            if values is None:
+                self._unfiltered[field].add(subscriber)
+                continue
+            index = self._by_value[field]
+            for value in values:
+                index.setdefault(value, set()).add(subscriber)
+        if 'precio_min' in filters or 'precio_max' in filters:
+            self._price[subscriber] = (filters.get('precio_min'), filters.get('precio_max'))
+    
+    def discard(self, subscriber) -> None:
+        filters = self.filters.pop(subscriber, None)
+        if filters is None:
+            return
+        for _, field in INDEXED_FIELDS:
+            values = filters.get(field)
+            if values is None:
+                self._unfiltered[field].discard(subscriber)
+                continue
+            index = self._by_value[field]
+            for value in values:
+                subscribers = index.get(value)
+                if subscribers is not None:
+                    subscribers.discard(subscriber)
+                    if not subscribers:
+                        del index[value]
+        self._price.pop(subscriber, None)
+    
+    def match(self, product: Dict[str, Any]) -> Set:
+        """Suscriptores con filtros cuyo criterio cumple el producto"""
+        candidates: Optional[Set] = None
+        for _, field in INDEXED_FIELDS:
+            group = self._by_value[field].get(product.get(field))
+            unfiltered = self._unfiltered[field]
+            group = group | unfiltered if group else unfiltered
+            candidates = set(group) if candidates is None else candidates & group
+            if not candidates:
+                return set()
+        
+        if self._price:
+            price = product.get('precio')
+            candidates = {
+                subscriber for subscriber in candidates
+                if subscriber not in self._price or self._in_range(price, *self._price[subscriber])
+            }
+        return candidates
+    
+    @staticmethod
+    def _in_range(price, low: Optional[float], high: Optional[float]) -> bool:
+        if not isinstance(price, (int, float)):
+            return False
+        return (low is None or price >= low) and (high is None or price <= high)
+    
+    def __contains__(self, subscriber) -> bool:
+        return subscriber in self.filters
+    
+    def __len__(self) -> int:
+        return len(self.filters)
@@ -5,7 +5,11 @@ Ejecutar: python run.py
 """
 import os
 import sys
+import time
+import signal
+import socket
 import subprocess
+import multiprocessing
 
 # Configurar variables de entorno (valores por defecto)
 os.environ.setdefault('WEBSOCKET_HOST', 'localhost')
@@ -13,6 +17,102 @@ os.environ.setdefault('WEBSOCKET_PORT', '8000')
 os.environ.setdefault('PING_INTERVAL', '10')
 os.environ.setdefault('PING_TIMEOUT', '5')
 os.environ.setdefault('POLL_INTERVAL', '5')
+os.environ.setdefault('BROADCAST_CONCURRENCY', '256')
+os.environ.setdefault('SEND_TIMEOUT', '5')
+os.environ.setdefault('DB_POOL_SIZE', '5')
+os.environ.setdefault('CHANGE_FEED_ENABLED', 'true')
+os.environ.setdefault('FEED_HEALTH_INTERVAL', '30')
+os.environ.setdefault('CATALOG_MAX_AGE', '60')
+os.environ.setdefault('MAX_PAGE_SIZE', '500')
+os.environ.setdefault('STREAM_CHUNK_SIZE', '500')
+os.environ.setdefault('MAX_DELTA_ROWS', '1000')
+os.environ.setdefault('MAX_BULK_PRODUCTS', '1000')
+os.environ.setdefault('CHANNEL_HISTORY_SIZE', '256')
+os.environ.setdefault('CHANNEL_HISTORY_MAX_CHANNELS', '10000')
+os.environ.setdefault('CHANNEL_HISTORY_MAX_BYTES', '1048576')
+os.environ.setdefault('CHANNEL_HISTORY_TOTAL_BYTES', '67108864')
+os.environ.setdefault('IDEMPOTENCY_CACHE_SIZE', '10000')
+os.environ.setdefault('IDEMPOTENCY_TTL', '600')
+os.environ.setdefault('WRITE_BEHIND_ENABLED', 'false')
+os.environ.setdefault('WRITE_BEHIND_MAX_BATCH', '100')
+os.environ.setdefault('WRITE_BEHIND_WINDOW', '0.02')
+os.environ.setdefault('PRESENCE_WINDOW', '1')
+os.environ.setdefault('OUTBOUND_QUEUE_SIZE', '256')
+os.environ.setdefault('OUTBOUND_POLICY', 'drop_oldest')
+os.environ.setdefault('MAX_MESSAGE_SIZE', '1048576')
+os.environ.setdefault('PARSER_STRICT', 'false')
+os.environ.setdefault('WS_COMPRESSION', 'deflate')
+os.environ.setdefault('WS_DEFLATE_WINDOW_BITS', '12')
+os.environ.setdefault('WS_DEFLATE_MEM_LEVEL', '5')
+os.environ.setdefault('WS_DEFLATE_LEVEL', '6')
+os.environ.setdefault('BATCH_WINDOW_MS', '5')
+os.environ.setdefault('BATCH_MAX_SIZE', '50')
+os.environ.setdefault('BATCH_MAX_BYTES', '65536')
+os.environ.setdefault('MAX_IN_FLIGHT', '8')
+os.environ.setdefault('WORKERS', '1')
+os.environ.setdefault('PRESENCE_REMOTE_TTL', '10')
+os.environ.setdefault('METRICS_ENABLED', 'true')
+os.environ.setdefault('METRICS_HOST', 'localhost')
+os.environ.setdefault('METRICS_PORT', '9101')
+os.environ.setdefault('METRICS_LAG_INTERVAL', '0.5')
+os.environ.setdefault('LOG_LEVEL', 'INFO')
+os.environ.setdefault('LOG_FORMAT', 'text')
+os.environ.setdefault('LOG_QUEUE_SIZE', '10000')
+os.environ.setdefault('LOG_SAMPLE_EVERY', '1')
+os.environ.setdefault('LOG_RATE_LIMIT', '10')
+os.environ.setdefault('LOG_RATE_WINDOW', '60')
+
+def parse_workers() -> int:
+    """Número de procesos: --workers N o la variable WORKERS"""
+    args = sys.argv[1:]
+    if '--workers' in args:
+        i = args.index('--workers')
+        if i + 1 < len(args):
+            return max(1, int(args[i + 1]))
+    return max(1, int(os.getenv('WORKERS', '1')))
+
+def run_worker(worker_id: int) -> None:
+    """Proceso worker: un servidor completo sobre el puerto compartido"""
+    os.environ['WORKER_ID'] = str(worker_id)
+    # terminate() del supervisor: apagado ordenado (flush de escrituras pendientes)
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    import app
+    import asyncio
+    try:
+        asyncio.run(app.WebSocketServer().start())
+    except KeyboardInterrupt:
+        pass
+
+def run_workers(count: int) -> None:
+    """Lanza el bus y `count` workers con SO_REUSEPORT, reiniciando los que caen"""
+    import bus
+    
+    path = os.environ.setdefault('BUS_SOCKET', f"/tmp/websoker-bus-{os.getenv('WEBSOCKET_PORT')}.sock")
+    broker = multiprocessing.Process(target=bus.run_broker, args=(path,), name='websoker-bus')
+    broker.start()
+    
+    workers = {}
+    for worker_id in range(count):
+        workers[worker_id] = multiprocessing.Process(target=run_worker, args=(worker_id,), name=f'websoker-{worker_id}')
+        workers[worker_id].start()
+    
+    try:
+        while True:
+            time.sleep(1)
+            if not broker.is_alive():
+                print("Bus de eventos caído, reiniciando...")
+                broker = multiprocessing.Process(target=bus.run_broker, args=(path,), name='websoker-bus')
+                broker.start()
+            for worker_id, process in list(workers.items()):
+                if not process.is_alive():
+                    print(f"Worker {worker_id} terminó (código {process.exitcode}), reiniciando...")
+                    workers[worker_id] = multiprocessing.Process(target=run_worker, args=(worker_id,), name=f'websoker-{worker_id}')
+                    workers[worker_id].start()
+    finally:
+        for process in [*workers.values(), broker]:
+            process.terminate()
+        for process in [*workers.values(), broker]:
+            process.join(timeout=5)
 
 def main():
     print("\n" + "="*60)
@@ -22,9 +122,22 @@ def main():
     print(f"   Host: {os.getenv('WEBSOCKET_HOST')}")
     print(f"   Puerto: {os.getenv('WEBSOCKET_PORT')}")
     print(f"   Heartbeat: {os.getenv('PING_INTERVAL')}s")
-    print(f"   Product Poll: {os.getenv('POLL_INTERVAL')}s")
+    print(f"   Product Feed: LISTEN/NOTIFY={os.getenv('CHANGE_FEED_ENABLED')} (fallback poll {os.getenv('POLL_INTERVAL')}s)")
+    
+    workers = parse_workers()
+    if workers > 1 and not hasattr(socket, 'SO_REUSEPORT'):
+        print("   SO_REUSEPORT no disponible en esta plataforma: se usa un solo proceso")
+        workers = 1
+    print(f"   Workers: {workers}")
     print("\n")
     
+    if workers > 1:
+        try:
+            run_workers(workers)
+        except KeyboardInterrupt:
+            print("\nServidor detenido por usuario")
+        sys.exit(0)
+    
     try:
         import app
         import asyncio
@@ -0,0 +1,77 @@
+"""
+Benchmark: tiempo de CPU por broadcast según número de conexiones.
+Compara serializar el mensaje por destinatario contra un Frame pre-codificado.
+Ejecutar: python scripts/bench_broadcast_encoding.py
+"""
+import os
+import sys
+import time
+import asyncio
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from models import ConnectionManager, Frame
+from broadcast import Broadcaster
+
+
+class FakeSocket:
+    """Socket simulado que descarta lo enviado"""
+    remote_address = ('127.0.0.1', 0)
+    
+    async def send(self, data) -> None:
+        pass
+    
+    async def close(self) -> None:
+        pass
+
+
+def sample_message() -> dict:
+    return {
+        'type': 'new_product',
+        'data': [{
+            'idProducto': i,
+            'nombreProducto': f'Producto {i}',
+            'descripcion': 'Descripción de prueba ' * 4,
+            'precio': 19.99 + i,
+            'stock': 10,
+            'imagenURL': 'https://example.com/img.jpg',
+            'categoriaIdCategoria': 3,
+            'emprendedorIdEmprendedor': 7,
+        } for i in range(5)]
+    }
+
+
+async def send_each(broadcaster: Broadcaster, clients: list, message) -> None:
+    """Mismo camino de envío; solo cambia si el mensaje llega pre-codificado"""
+    for ws in clients:
+        await broadcaster.send(ws, message)
+
+
+async def main() -> None:
+    message = sample_message()
+    rounds = 20
+    
+    print(f"{'conexiones':>10} | {'json por cliente (ms)':>22} | {'Frame único (ms)':>17}")
+    print('-' * 56)
+    for count in (100, 1000, 5000, 10000):
+        connections = ConnectionManager()
+        clients = [FakeSocket() for _ in range(count)]
+        for ws in clients:
+            connections.add_client(ws)
+        broadcaster = Broadcaster(connections)
+        
+        start = time.process_time()
+        for _ in range(rounds):
+            await send_each(broadcaster, clients, message)
+        naive = (time.process_time() - start) / rounds * 1000
+        
+        start = time.process_time()
+        for _ in range(rounds):
+            await send_each(broadcaster, clients, Frame(message))
+        framed = (time.process_time() - start) / rounds * 1000
+        
+        print(f"{count:>10} | {naive:>22.2f} | {framed:>17.2f}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,87 @@
+"""
+Benchmark de codecs de transporte.
+Compara bytes en el cable y CPU de codificar/decodificar por codec
+(json stdlib, json vía orjson, msgpack y cbor si están instalados), sin y
+con permessage-deflate usando los mismos ajustes que el servidor.
+Ejecutar: python scripts/bench_codecs.py
+"""
+import os
+import sys
+import json
+import time
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import wire
+
+
+def make_products(count: int) -> list:
+    return [{
+        'idProducto': i,
+        'nombreProducto': f'Producto artesanal {i}',
+        'descripcion': 'Hecho a mano con materiales locales, envío en 48 horas.',
+        'precio': round(1000 + i * 3.75, 2),
+        'stock': i % 40,
+        'imagenURL': f'https://cdn.example.com/productos/{i}.jpg',
+        'emprendedorIdEmprendedor': i % 120,
+        'categoriaIdCategoria': i % 12,
+    } for i in range(1, count + 1)]
+
+
+class StdlibJson:
+    """Referencia: json.dumps/json.loads de la biblioteca estándar"""
+    name = 'json (stdlib)'
+    
+    def encode(self, message):
+        return json.dumps(message)
+    
+    def decode(self, raw):
+        return json.loads(raw)
+
+
+def timed(fn, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def deflate(payload) -> int:
+    """Tamaño comprimido con los ajustes de permessage-deflate del servidor"""
+    data = payload.encode() if isinstance(payload, str) else payload
+    compressor = zlib.compressobj(
+        level=int(os.getenv('WS_DEFLATE_LEVEL', '6')),
+        wbits=-int(os.getenv('WS_DEFLATE_WINDOW_BITS', '12')),
+        memLevel=int(os.getenv('WS_DEFLATE_MEM_LEVEL', '5')),
+    )
+    return len(compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH))
+
+
+def main():
+    codecs = [StdlibJson()]
+    if wire.orjson is not None:
+        codecs.append(wire.JSON)
+    codecs += [codec for codec in wire.CODECS.values() if codec.binary]
+    
+    cases = [
+        ('products (2000 filas)', {'type': 'products', 'data': make_products(2000), 'version': 1}, 20),
+        ('new_product (1 fila)', {'type': 'new_product', 'data': make_products(1)}, 20000),
+        ('clients_count', {'type': 'clients_count', 'data': {'count': 12, 'clientsOnline': 12, 'timestamp': '1234.5'}}, 20000),
+    ]
+    
+    for label, message, repeat in cases:
+        print(f"\n{label}")
+        print(f"   {'codec':<16} {'bytes':>9} {'deflate':>9} {'encode':>11} {'decode':>11}")
+        for codec in codecs:
+            payload = codec.encode(message)
+            assert codec.decode(payload) == message
+            encode_s = timed(lambda: codec.encode(message), repeat)
+            decode_s = timed(lambda: codec.decode(payload), repeat)
+            name = codec.name if codec is not wire.JSON else 'json (orjson)'
+            print(f"   {name:<16} {len(payload):>9} {deflate(payload):>9} "
+                  f"{encode_s * 1e6:>9.1f}µs {decode_s * 1e6:>9.1f}µs")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""
+Micro-benchmark de ConnectionManager con conexiones simuladas.
+Mide add/subscribe/unsubscribe/remove y muestra que el costo por operación
+no crece con el número de conexiones (antes remove_client era O(N)).
+Ejecutar: python scripts/bench_connection_manager.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from models import ConnectionManager
+
+
+class FakeSocket:
+    """Socket simulado: solo expone remote_address"""
+    __slots__ = ('remote_address',)
+    
+    def __init__(self, index: int):
+        # Varias pestañas comparten IP, como detrás de un NAT
+        self.remote_address = (f'10.{index % 200}.{(index // 200) % 250}.1', 40000 + index % 20000)
+
+
+def timed(label: str, count: int, fn) -> None:
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    print(f"   {label:<12} {elapsed * 1000:>9.1f} ms  ({elapsed / count * 1e6:.2f} µs/op)")
+
+
+def run(count: int) -> None:
+    manager = ConnectionManager()
+    sockets = [FakeSocket(i) for i in range(count)]
+    channels = [f'categoria.{i % 50}' for i in range(count)]
+    
+    print(f"\n{count} conexiones:")
+    timed('add', count, lambda: [manager.add_client(ws) for ws in sockets])
+    timed('subscribe', count, lambda: [manager.subscribe(ws, ch) for ws, ch in zip(sockets, channels)])
+    timed('unsubscribe', count, lambda: [manager.unsubscribe(ws, ch) for ws, ch in zip(sockets, channels)])
+    timed('resubscribe', count, lambda: [manager.subscribe(ws, ch) for ws, ch in zip(sockets, channels)])
+    timed('remove', count, lambda: [manager.remove_client(ws) for ws in sockets])
+    assert not manager.clients and not manager.subscriptions and not manager.ip_counts
+
+
+if __name__ == '__main__':
+    for n in (1000, 10000, 100000):
+        run(n)
@@ -0,0 +1,141 @@
+"""
+Fuzz + benchmark del parser de mensajes entrantes.
+- Fuzz: muta mensajes válidos (cortes, bytes al azar, anidamiento profundo)
+  y verifica que MessageHandler.decode nunca lance excepción.
+- Benchmark: mensajes/s con entrada válida e inválida para el parser
+  original, el actual (con reparación) y el modo estricto.
+Ejecutar: python scripts/bench_parser.py
+"""
+import os
+import sys
+import json
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import wire
+from handlers import MessageHandler
+
+
+def original_parse(raw):
+    """Referencia: parse_message antes del cambio (strip + reparación siempre)"""
+    if not raw or not isinstance(raw, str):
+        return False, None
+    raw = raw.strip()
+    try:
+        return True, json.loads(raw)
+    except json.JSONDecodeError:
+        pass
+    repaired = raw
+    opens = repaired.count('{')
+    closes = repaired.count('}')
+    if opens > closes:
+        repaired += '}' * (opens - closes)
+    try:
+        return True, json.loads(repaired)
+    except json.JSONDecodeError:
+        return False, None
+
+
+def make_handler(strict: bool) -> MessageHandler:
+    handler = MessageHandler(None, None, None, None)
+    handler.strict = strict
+    return handler
+
+
+def valid_messages(rng: random.Random) -> list:
+    product = {'nombre': 'Producto', 'descripcion': 'x' * 200, 'precio': 10.5, 'stock': 3}
+    return [
+        json.dumps({'action': 'ping'}),
+        json.dumps({'action': 'subscribe', 'channel': f'categoria.{rng.randrange(50)}'}),
+        json.dumps({'action': 'notify', 'channel': 'c1', 'payload': {'texto': 'hola ' * 20}}),
+        json.dumps({'action': 'add_product', 'product': product}),
+        json.dumps({'action': 'add_products', 'products': [product] * 200}),
+    ]
+
+
+def invalid_messages(rng: random.Random, valid: list) -> list:
+    big = valid[-1]
+    return [
+        ('truncado', big[:len(big) // 2]),
+        ('comillas simples', big.replace('"', "'")),
+        ('falta una llave', '{"action": "ping"'),
+        ('acción desconocida', '{"action": "borrar_todo", "payload": "' + 'x' * 50000 + '"}'),
+        ('anidamiento profundo', '[' * 50000 + ']' * 50000),
+        ('ruido', ''.join(rng.choice('{}[]":,abc ') for _ in range(20000))),
+    ]
+
+
+def mutate(rng: random.Random, raw: str) -> str:
+    kind = rng.randrange(5)
+    if kind == 0:
+        return raw[:rng.randrange(len(raw) + 1)]
+    if kind == 1:
+        i = rng.randrange(len(raw))
+        return raw[:i] + chr(rng.randrange(0x20, 0x2fff)) + raw[i + 1:]
+    if kind == 2:
+        return '{' * rng.randrange(1, 3000) + raw
+    if kind == 3:
+        i = rng.randrange(len(raw))
+        return raw[:i] + raw[i + 1:]
+    return raw.encode('utf-8', 'ignore')[:rng.randrange(len(raw) + 1)] if rng.random() < 0.5 else raw + '}' * 10
+
+
+def fuzz(handlers: list, corpus: list, rng: random.Random, rounds: int) -> None:
+    for _ in range(rounds):
+        raw = mutate(rng, rng.choice(corpus))
+        for handler in handlers:
+            data, error = handler.decode(raw, wire.JSON)
+            assert (data is None) != (error is None), 'decode debe retornar datos o error'
+    print(f"Fuzz: {rounds} mutaciones sin excepciones")
+
+
+def bench(label: str, parse, messages: list, seconds: float = 1.0) -> None:
+    count = 0
+    size = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        for raw in messages:
+            parse(raw)
+            size += len(raw)
+        count += len(messages)
+    elapsed = time.perf_counter() - start
+    print(f"   {label:<22} {count / elapsed:>12,.0f} msg/s  {size / elapsed / 1e6:>8.1f} MB/s")
+
+
+def per_message(parse, raw: str, repeat: int = 50) -> str:
+    """µs por mensaje, o la excepción que escapa del parser"""
+    start = time.perf_counter()
+    try:
+        for _ in range(repeat):
+            parse(raw)
+    except Exception as e:
+        return type(e).__name__
+    return f"{(time.perf_counter() - start) / repeat * 1e6:.1f}µs"
+
+
+def main():
+    rng = random.Random(7)
+    lenient = make_handler(strict=False)
+    strict = make_handler(strict=True)
+    valid = valid_messages(rng)
+    invalid = invalid_messages(rng, valid)
+    
+    fuzz([lenient, strict], valid + [raw for _, raw in invalid], rng, 20000)
+    
+    print("\nEntrada válida")
+    bench('original', original_parse, valid)
+    bench('actual (reparación)', lambda raw: lenient.decode(raw, wire.JSON), valid)
+    bench('actual (estricto)', lambda raw: strict.decode(raw, wire.JSON), valid)
+    
+    print("\nEntrada inválida")
+    print(f"   {'caso':<22} {'original':>16} {'reparación':>16} {'estricto':>16}")
+    for label, raw in invalid:
+        print(f"   {label:<22} {per_message(original_parse, raw):>16} "
+              f"{per_message(lambda r: lenient.decode(r, wire.JSON), raw):>16} "
+              f"{per_message(lambda r: strict.decode(r, wire.JSON), raw):>16}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""
+Benchmark de decodificación de filas de producto (100k filas).
+Compara el camino anterior (SELECT * + RealDictCursor + dict(row) +
+convert_to_json_compatible) con el actual (columnas explícitas, tuplas,
+NUMERIC -> float en el typecaster y dict(zip(...))).
+Con DB_HOST configurado mide contra PostgreSQL usando una tabla temporal
+`producto` (oculta la real solo en esa sesión); si no hay BD, simula las
+filas de texto que entrega libpq y aplica los mismos typecasters.
+Ejecutar: python scripts/bench_row_decoding.py [filas]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from psycopg2.extensions import DECIMAL, INTEGER
+from psycopg2.extras import RealDictCursor, RealDictRow
+
+import database
+from database import DatabaseManager, PRODUCT_COLUMNS, NUMERIC_AS_FLOAT, product_rows
+from utils import convert_to_json_compatible
+
+
+CREATE_TABLE = '''
+CREATE TEMP TABLE producto (
+    "idProducto" serial PRIMARY KEY,
+    "nombreProducto" text,
+    "descripcion" text,
+    "precio" numeric(10, 2),
+    "stock" integer,
+    "imagenURL" text,
+    "emprendedorIdEmprendedor" integer,
+    "categoriaIdCategoria" integer
+)
+'''
+
+FILL_TABLE = '''
+INSERT INTO producto ("nombreProducto", "descripcion", "precio", "stock", "imagenURL",
+                      "emprendedorIdEmprendedor", "categoriaIdCategoria")
+SELECT 'Producto ' || i, 'Hecho a mano con materiales locales', 1000 + i * 3.75, i % 40,
+       'https://cdn.example.com/productos/' || i || '.jpg', i % 120, i % 12
+FROM generate_series(1, %s) AS i
+'''
+
+
+def original_fetch(conn):
+    """Referencia: el camino anterior a este cambio"""
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute('SELECT * FROM producto ORDER BY "idProducto"')
+    products = cur.fetchall()
+    return [convert_to_json_compatible(dict(row)) for row in products]
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+
+def report(count: int, before: float, after: float) -> None:
+    print(f"   anterior: {before * 1e3:>8.1f} ms  ({before / count * 1e9:>6.0f} ns/fila)")
+    print(f"   actual:   {after * 1e3:>8.1f} ms  ({after / count * 1e9:>6.0f} ns/fila)")
+    print(f"   mejora:   {before / after:.2f}x")
+
+
+def bench_postgres(count: int) -> bool:
+    from config import get_db_connection
+    old_conn = get_db_connection()
+    new_conn = get_db_connection() if old_conn is not None else None
+    if new_conn is None:
+        return False
+    database.register_row_types(new_conn)
+    for conn in (old_conn, new_conn):
+        cur = conn.cursor()
+        cur.execute(CREATE_TABLE)
+        cur.execute(FILL_TABLE, (count,))
+        conn.commit()
+    
+    # Una pasada de calentamiento por camino
+    original_fetch(old_conn)
+    DatabaseManager._fetch_all_products(new_conn)
+    
+    before, old_rows = timed(original_fetch, old_conn)
+    after, new_rows = timed(DatabaseManager._fetch_all_products, new_conn)
+    assert old_rows == new_rows
+    print(f"\nPostgreSQL, {count} filas (consulta + decodificación)")
+    report(count, before, after)
+    old_conn.close()
+    new_conn.close()
+    return True
+
+
+def bench_offline(count: int) -> None:
+    # Texto tal como lo entrega libpq, columna por columna
+    raw = [(
+        str(i), f'Producto {i}', 'Hecho a mano con materiales locales', f'{1000 + i * 3.75:.2f}',
+        str(i % 40), f'https://cdn.example.com/productos/{i}.jpg', str(i % 120), str(i % 12),
+    ) for i in range(1, count + 1)]
+    
+    def decode_before():
+        rows = [
+            RealDictRow(zip(PRODUCT_COLUMNS, (
+                INTEGER(r[0], None), r[1], r[2], DECIMAL(r[3], None),
+                INTEGER(r[4], None), r[5], INTEGER(r[6], None), INTEGER(r[7], None),
+            ))) for r in raw
+        ]
+        return [convert_to_json_compatible(dict(row)) for row in rows]
+    
+    def decode_after():
+        rows = [(
+            INTEGER(r[0], None), r[1], r[2], NUMERIC_AS_FLOAT(r[3], None),
+            INTEGER(r[4], None), r[5], INTEGER(r[6], None), INTEGER(r[7], None),
+        ) for r in raw]
+        return product_rows(rows)
+    
+    decode_before()
+    decode_after()
+    before, old_rows = timed(decode_before)
+    after, new_rows = timed(decode_after)
+    assert old_rows == new_rows
+    print(f"\nSimulado (sin PostgreSQL), {count} filas (typecast + armado de filas)")
+    report(count, before, after)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    if not (os.getenv('DB_HOST') and bench_postgres(count)):
+        bench_offline(count)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Micro-benchmark de suscripciones por patrón.
+Compara resolver los suscriptores de un canal con el trie de segmentos
+(PatternIndex) contra recorrer todos los patrones, con miles de canales y
+patrones. También verifica que ambos den el mismo resultado.
+Ejecutar: python scripts/bench_subscriptions.py
+"""
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from subscriptions import PatternIndex, SEPARATOR, ANY_SEGMENT, ANY_SUFFIX
+
+
+def scan_match(patterns: list, channel: str) -> set:
+    """Referencia: compara el canal contra cada patrón registrado"""
+    segments = channel.split(SEPARATOR)
+    matched = set()
+    for pattern, subscriber in patterns:
+        parts = pattern.split(SEPARATOR)
+        if parts[-1] == ANY_SUFFIX:
+            prefix = parts[:-1]
+            if len(segments) <= len(prefix):
+                continue
+        else:
+            prefix = parts
+            if len(segments) != len(prefix):
+                continue
+        if all(p == ANY_SEGMENT or p == s for p, s in zip(prefix, segments)):
+            matched.add(subscriber)
+    return matched
+
+
+def build(rng: random.Random, pattern_count: int, channel_count: int):
+    channels = []
+    for _ in range(channel_count):
+        kind = rng.random()
+        if kind < 0.4:
+            channels.append(f'categoria.{rng.randrange(50)}')
+        elif kind < 0.8:
+            channels.append(f'emprendedor.{rng.randrange(2000)}.productos.{rng.choice(["nuevo", "precio", "stock"])}')
+        else:
+            channels.append(f'pedido.{rng.randrange(5000)}')
+    
+    patterns = []
+    for subscriber in range(pattern_count):
+        kind = rng.random()
+        if kind < 0.3:
+            pattern = f'categoria.{rng.randrange(50)}'
+        elif kind < 0.4:
+            pattern = 'categoria.*'
+        elif kind < 0.8:
+            pattern = f'emprendedor.{rng.randrange(2000)}.**'
+        elif kind < 0.9:
+            pattern = 'emprendedor.*.productos.nuevo'
+        else:
+            pattern = f'pedido.{rng.randrange(5000)}'
+        patterns.append((pattern, subscriber))
+    return channels, patterns
+
+
+def main():
+    rng = random.Random(42)
+    for pattern_count in (1_000, 10_000, 50_000):
+        channels, patterns = build(rng, pattern_count, 5_000)
+        
+        index = PatternIndex()
+        start = time.perf_counter()
+        for pattern, subscriber in patterns:
+            index.add(pattern, subscriber)
+        build_ms = (time.perf_counter() - start) * 1000
+        
+        start = time.perf_counter()
+        trie_results = [index.match(channel) for channel in channels]
+        trie_s = time.perf_counter() - start
+        
+        sample = channels[:200]
+        start = time.perf_counter()
+        scan_results = [scan_match(patterns, channel) for channel in sample]
+        scan_s = (time.perf_counter() - start) * len(channels) / len(sample)
+        
+        assert trie_results[:len(sample)] == scan_results, 'el trie no coincide con el recorrido completo'
+        
+        print(f"\n{pattern_count} patrones, {len(channels)} canales (índice construido en {build_ms:.1f} ms)")
+        print(f"   trie:      {trie_s * 1000:>9.1f} ms  ({trie_s / len(channels) * 1e6:.2f} µs/canal)")
+        print(f"   recorrido: {scan_s * 1000:>9.1f} ms  ({scan_s / len(channels) * 1e6:.2f} µs/canal, estimado)")
+        print(f"   mejora:    {scan_s / trie_s:.0f}x")
+        
+        for pattern, subscriber in patterns:
+            index.remove(pattern, subscriber)
+        assert len(index) == 0 and index._root.is_empty(), 'quedaron nodos sin podar'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,26 @@
+"""
+Instala el trigger de PostgreSQL que alimenta el feed LISTEN/NOTIFY de productos.
+Ejecutar una vez por base de datos: python scripts/install_product_trigger.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from config import get_db_connection
+from change_feed import install_trigger, CHANNEL
+
+
+def main() -> None:
+    conn = get_db_connection()
+    if conn is None:
+        sys.exit(1)
+    try:
+        install_trigger(conn)
+        print(f"Trigger instalado: producto -> canal '{CHANNEL}'")
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""Índice de suscripciones por patrón (trie de segmentos)"""
+from typing import Dict, List, Optional, Set
+
+
+SEPARATOR = '.'
+ANY_SEGMENT = '*'    # exactamente un segmento:   categoria.*        -> categoria.5
+ANY_SUFFIX = '**'    # uno o más segmentos (final): emprendedor.42.** -> emprendedor.42.productos.nuevo
+
+
+class _Node:
+    __slots__ = ('children', 'star', 'subscribers', 'tail')
+    
+    def __init__(self):
+        self.children: Dict[str, '_Node'] = {}
+        self.star: Optional['_Node'] = None
+        self.subscribers: Set = set()  # patrones que terminan aquí
+        self.tail: Set = set()         # patrones que terminan aquí con '**'
+    
+    def is_empty(self) -> bool:
+        return not (self.children or self.star or self.subscribers or self.tail)
+
+
+class PatternIndex:
+    """
+    Suscripciones con comodines indexadas por segmento. Resolver un canal
+    recorre solo las ramas que coinciden con sus segmentos, sin revisar
+    todos los patrones registrados.
+    """
+    
+    def __init__(self):
+        self._root = _Node()
+        self._count = 0
+    
+    @staticmethod
+    def is_pattern(channel: str) -> bool:
+        return ANY_SEGMENT in channel and any(
+            segment in (ANY_SEGMENT, ANY_SUFFIX) for segment in channel.split(SEPARATOR)
+        )
+    
+    @staticmethod
+    def validate(pattern: str) -> Optional[str]:
+        """Retorna: mensaje de error, o None si el patrón es válido"""
+        segments = pattern.split(SEPARATOR)
+        if ANY_SUFFIX in segments[:-1]:
+            return f'"{ANY_SUFFIX}" solo puede ir al final del patrón'
+        if '' in segments:
+            return 'El patrón tiene segmentos vacíos'
+        return None
+    
+    def add(self, pattern: str, subscriber) -> None:
+        segments = pattern.split(SEPARATOR)
+        tail = segments[-1] == ANY_SUFFIX
+        if tail:
+            segments.pop()
+        
+        node = self._root
+        for segment in segments:
+            if segment == ANY_SEGMENT:
+                if node.star is None:
+                    node.star = _Node()
+                node = node.star
+            else:
+                node = node.children.setdefault(segment, _Node())
+        
+        bucket = node.tail if tail else node.subscribers
+        if subscriber not in bucket:
+            bucket.add(subscriber)
+            self._count += 1
+    
+    def remove(self, pattern: str, subscriber) -> None:
+        segments = pattern.split(SEPARATOR)
+        tail = segments[-1] == ANY_SUFFIX
+        if tail:
+            segments.pop()
+        
+        path: List[tuple] = []  # (padre, segmento) para podar ramas vacías
+        node = self._root
+        for segment in segments:
+            child = node.star if segment == ANY_SEGMENT else node.children.get(segment)
+            if child is None:
+                return
+            path.append((node, segment))
+            node = child
+        
+        bucket = node.tail if tail else node.subscribers
+        if subscriber not in bucket:
+            return
+        bucket.discard(subscriber)
+        self._count -= 1
+        
+        for parent, segment in reversed(path):
+            if not node.is_empty():
+                break
+            if segment == ANY_SEGMENT:
+                parent.star = None
+            else:
+                del parent.children[segment]
+            node = parent
+    
+    def match(self, channel: str) -> Set:
+        """Suscriptores de todos los patrones que coinciden con el canal"""
+        matched: Set = set()
+        nodes = [self._root]
+        for segment in channel.split(SEPARATOR):
+            next_nodes = []
+            for node in nodes:
+                if node.tail:
+                    matched |= node.tail
+                child = node.children.get(segment)
+                if child is not None:
+                    next_nodes.append(child)
+                if node.star is not None:
+                    next_nodes.append(node.star)
+            if not next_nodes:
+                return matched
+            nodes = next_nodes
+        
+        for node in nodes:
+            if node.subscribers:
+                matched |= node.subscribers
+        return matched
+    
+    def __len__(self) -> int:
+        """Número de pares (patrón, suscriptor) registrados"""
+        return self._count
@@ -1,7 +1,7 @@
 """Utilidades para manejo de datos"""
 import json
 from decimal import Decimal
-from typing import Any, Dict, Tuple, Optional
+from typing import Any, Callable, Dict, Tuple, Optional
 
 
 def convert_to_json_compatible(obj: Any) -> Any:
@@ -15,34 +15,42 @@ def convert_to_json_compatible(obj: Any) -> Any:
     return obj
 
 
-def parse_message(raw: str) -> Tuple[bool, Optional[Dict]]:
+# La reparación recorre el texto otra vez: solo para mensajes chicos
+REPAIR_MAX_LENGTH = 64 * 1024
+
+
+def parse_message(raw: str, loads: Callable[[str], Any] = json.loads,
+                  repair: bool = True) -> Tuple[bool, Optional[Dict]]:
     """
-    Parsea un mensaje JSON. Si falla, intenta repararlo.
+    Parsea un mensaje JSON. Si falla, intenta repararlo (salvo repair=False).
+    `loads` permite usar un decodificador más rápido (ver wire.py).
     Retorna: (éxito, datos_parseados)
     """
     if not raw or not isinstance(raw, str):
         return False, None
     
-    raw = raw.strip()
-    
-    # Intento 1: JSON válido
+    # Intento 1: JSON válido (loads ya ignora espacios alrededor)
     try:
-        return True, json.loads(raw)
-    except json.JSONDecodeError:
+        return True, loads(raw)
+    except (ValueError, RecursionError):
         pass
     
+    if not repair or len(raw) > REPAIR_MAX_LENGTH:
+        return False, None
+    
     # Intento 2: Reparar JSONs malformados
-    repaired = raw
+    repaired = raw.strip()
     
-    # Balancear llaves
+    # Balancear llaves; si no faltan, no hay nada que reintentar
     opens = repaired.count('{')
     closes = repaired.count('}')
-    if opens > closes:
-        repaired += '}' * (opens - closes)
+    if opens <= closes:
+        return False, None
+    repaired += '}' * (opens - closes)
     
     try:
-        return True, json.loads(repaired)
-    except json.JSONDecodeError:
+        return True, loads(repaired)
+    except (ValueError, RecursionError):
         return False, None
 
 
@@ -0,0 +1,193 @@
+"""
+Codecs de transporte por conexión: JSON (orjson si está instalado),
+MessagePack y CBOR (opcionales), y ajustes de permessage-deflate.
+El cliente elige con el subprotocolo `websoker.<codec>` o con `hello`.
+"""
+import os
+import re
+import json
+import struct
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from websockets.extensions.permessage_deflate import ServerPerMessageDeflateFactory
+
+from utils import parse_message
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+
+SUBPROTOCOL_PREFIX = 'websoker.'
+
+# `action` como primera clave, la forma en que lo envían los clientes
+_ACTION_PREFIX = re.compile(r'\s*\{\s*"action"\s*:\s*"([A-Za-z0-9_]{1,64})"')
+
+
+def dumps(message: Any) -> str:
+    """JSON en texto, con orjson cuando está disponible"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(message).decode()
+        except TypeError:
+            pass
+    return json.dumps(message)
+
+
+loads: Callable[[Union[str, bytes]], Any] = orjson.loads if orjson is not None else json.loads
+
+
+class JsonCodec:
+    """Frames de texto JSON (el formato original)"""
+    name = 'json'
+    binary = False
+    
+    def encode(self, message: Any) -> str:
+        return dumps(message)
+    
+    def decode(self, raw: Union[str, bytes]) -> Any:
+        return loads(raw)
+    
+    def encode_batch(self, payloads: List[str]) -> str:
+        """Frame `batch` concatenando mensajes ya codificados"""
+        return '{"type":"batch","messages":[' + ','.join(payloads) + ']}'
+
+
+class MsgpackCodec:
+    """Frames binarios MessagePack"""
+    name = 'msgpack'
+    binary = True
+    
+    def __init__(self):
+        # Mapa de 2 entradas: {"type": "batch", "messages": <array>}
+        self._batch_prefix = b'\x82' + msgpack.packb('type') + msgpack.packb('batch') + msgpack.packb('messages')
+    
+    def encode(self, message: Any) -> bytes:
+        return msgpack.packb(message, use_bin_type=True)
+    
+    def decode(self, raw: bytes) -> Any:
+        return msgpack.unpackb(raw, raw=False)
+    
+    def encode_batch(self, payloads: List[bytes]) -> bytes:
+        count = len(payloads)
+        if count < 16:
+            header = bytes([0x90 | count])
+        elif count < 0x10000:
+            header = b'\xdc' + struct.pack('>H', count)
+        else:
+            header = b'\xdd' + struct.pack('>I', count)
+        return self._batch_prefix + header + b''.join(payloads)
+
+
+class CborCodec:
+    """Frames binarios CBOR"""
+    name = 'cbor'
+    binary = True
+    
+    def __init__(self):
+        self._batch_prefix = b'\xa2' + cbor2.dumps('type') + cbor2.dumps('batch') + cbor2.dumps('messages')
+    
+    def encode(self, message: Any) -> bytes:
+        return cbor2.dumps(message)
+    
+    def decode(self, raw: bytes) -> Any:
+        return cbor2.loads(raw)
+    
+    def encode_batch(self, payloads: List[bytes]) -> bytes:
+        count = len(payloads)
+        if count < 24:
+            header = bytes([0x80 | count])
+        elif count < 0x100:
+            header = bytes([0x98, count])
+        elif count < 0x10000:
+            header = b'\x99' + struct.pack('>H', count)
+        else:
+            header = b'\x9a' + struct.pack('>I', count)
+        return self._batch_prefix + header + b''.join(payloads)
+
+
+JSON = JsonCodec()
+
+# Codecs disponibles según las dependencias instaladas (JSON siempre)
+CODECS: Dict[str, Any] = {JSON.name: JSON}
+if msgpack is not None:
+    CODECS[MsgpackCodec.name] = MsgpackCodec()
+if cbor2 is not None:
+    CODECS[CborCodec.name] = CborCodec()
+
+
+def get_codec(name: Optional[str]):
+    """Codec por nombre, o None si no existe o no está instalado"""
+    return CODECS.get(name) if name else None
+
+
+def codec_for_subprotocol(subprotocol: Optional[str]):
+    """Codec negociado en el handshake (JSON si no hubo subprotocolo)"""
+    if subprotocol and subprotocol.startswith(SUBPROTOCOL_PREFIX):
+        return CODECS.get(subprotocol[len(SUBPROTOCOL_PREFIX):], JSON)
+    return JSON
+
+
+def sniff_action(raw: Union[str, bytes]) -> Optional[str]:
+    """
+    `action` leída del inicio del texto sin parsear el mensaje completo,
+    o None si no está como primera clave (entonces decide el parseo normal).
+    """
+    if not isinstance(raw, str):
+        return None
+    match = _ACTION_PREFIX.match(raw, 0, 256)
+    return match.group(1) if match else None
+
+
+def parse(raw: Union[str, bytes], codec=None, strict: bool = False) -> Tuple[bool, Any]:
+    """
+    Decodifica un mensaje entrante. Los frames de texto son JSON (con la
+    reparación de parse_message, salvo en modo estricto); los binarios usan
+    el codec binario de la conexión, o el primero que los entienda.
+    Retorna: (éxito, datos)
+    """
+    if isinstance(raw, str):
+        return parse_message(raw, loads=loads, repair=not strict)
+    
+    candidates = [codec] if codec is not None and codec.binary else [c for c in CODECS.values() if c.binary]
+    for candidate in candidates:
+        try:
+            return True, candidate.decode(raw)
+        except Exception:
+            continue
+    try:
+        return parse_message(raw.decode('utf-8'), loads=loads, repair=not strict)
+    except UnicodeDecodeError:
+        return False, None
+
+
+def serve_options() -> Dict[str, Any]:
+    """Argumentos de websockets.serve: subprotocolos, tamaño máximo y permessage-deflate"""
+    options: Dict[str, Any] = {
+        'subprotocols': [SUBPROTOCOL_PREFIX + name for name in CODECS],
+        'compression': None,
+        # Frames más grandes cierran la conexión (1009) antes de llegar al parser
+        'max_size': int(os.getenv('MAX_MESSAGE_SIZE', str(1024 * 1024))),
+    }
+    if os.getenv('WS_COMPRESSION', 'deflate').lower() == 'deflate':
+        window_bits = int(os.getenv('WS_DEFLATE_WINDOW_BITS', '12'))
+        options['extensions'] = [ServerPerMessageDeflateFactory(
+            server_max_window_bits=window_bits,
+            client_max_window_bits=window_bits,
+            compress_settings={
+                'memLevel': int(os.getenv('WS_DEFLATE_MEM_LEVEL', '5')),
+                'level': int(os.getenv('WS_DEFLATE_LEVEL', '6')),
+            },
+        )]
+    return options
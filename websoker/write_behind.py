@@ -0,0 +1,79 @@
+"""Cola write-behind: agrupa escrituras individuales en lotes con un solo commit"""
+import asyncio
+from typing import Any, Awaitable, Callable, List, Optional, Set, Tuple
+
+
+class WriteBehindQueue:
+    """
+    Acumula escrituras y las entrega juntas a `flush` cuando se llena el lote
+    (`max_batch`) o vence la ventana (`window` segundos) desde la primera.
+    
+    `flush` recibe la lista de elementos y retorna una lista del mismo largo
+    con el resultado de cada uno, o la excepción de esa fila: un fallo solo
+    afecta al llamador de ese elemento.
+    """
+    
+    def __init__(self, flush: Callable[[List[Any]], Awaitable[List[Any]]],
+                 max_batch: int = 100, window: float = 0.02):
+        self.flush = flush
+        self.max_batch = max(1, max_batch)
+        self.window = window
+        self.batches = 0
+        self.items = 0
+        self._pending: List[Tuple[Any, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flushing: Set[asyncio.Task] = set()
+        self._closed = False
+    
+    async def submit(self, item: Any) -> Any:
+        """Encola un elemento y espera su resultado (o la excepción de su fila)"""
+        if self._closed:
+            raise RuntimeError('Cola write-behind cerrada')
+        
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        
+        if len(self._pending) >= self.max_batch:
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._start_flush)
+        return await future
+    
+    async def close(self) -> None:
+        """Escribe lo pendiente y espera los lotes en curso (apagado ordenado)"""
+        self._closed = True
+        self._start_flush()
+        if self._flushing:
+            await asyncio.gather(*self._flushing, return_exceptions=True)
+    
+    def _start_flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        task = asyncio.ensure_future(self._flush(batch))
+        self._flushing.add(task)
+        task.add_done_callback(self._flushing.discard)
+    
+    async def _flush(self, batch: List[Tuple[Any, asyncio.Future]]) -> None:
+        try:
+            results = await self.flush([item for item, _ in batch])
+        except Exception as e:
+            # Fallo del lote completo (p. ej. conexión caída): todos reciben el error
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        
+        self.batches += 1
+        self.items += len(batch)
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)